@@ -1,11 +1,44 @@
-import joblib
+import os
+import csv
+import json
+import time
+import tempfile
+import metrics
+import artifacts
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import preprocess_util
-from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
+from typing import Any
+from coalescer import PredictionCoalescer
+from prediction_cache import PredictionCache
+from pydantic import BaseModel, ValidationError
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 app = FastAPI()
 
+if(metrics.ENABLED):
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            # Route template instead of raw path, so unknown paths don't create new label values
+            route = request.scope.get("route")
+            labels = (("endpoint", route.path if route is not None else "unmatched"),)
+
+            metrics.registry.inc("credit_scoring_requests_total", labels)
+            if(status_code >= 400):
+                metrics.registry.inc("credit_scoring_errors_total", labels)
+
+            metrics.registry.observe("credit_scoring_request_seconds", time.perf_counter() - start, labels)
+
 class Prediction_Data(BaseModel):
     person_age: int = 24
     person_income: int = 37500
@@ -19,25 +52,52 @@ class Prediction_Data(BaseModel):
     cb_person_default_on_file: str = "Y"
     cb_person_cred_hist_length: int = 3
 
-num_imputer = joblib.load("../models/preprocess_num_imputer_20221231.pkl")
-cat_imputer = joblib.load("../models/preprocess_cat_imputer_20221231.pkl")
-ohe_encoder = joblib.load("../models/preprocess_ohe_20221231.pkl")
-scaler = joblib.load("../models/preprocess_scaler_20221231.pkl")
-model = joblib.load("../models/best_model.pkl")
+class Batch_Prediction_Data(BaseModel):
+    records: list[Any]
 
-@app.post("/predict/")
-def predict_data(data: Prediction_Data):
-    data = pd.DataFrame(data).set_index(0).T.reset_index(drop = True)
-
-    data = preprocess_util.transform_preprocess_data(
-        X = data,
-        num_imputer = num_imputer,
-        cat_imputer = cat_imputer,
-        ohe_encoder = ohe_encoder,
-        scaler = scaler
-    )
+# Maximum number of records accepted by a single call of batch endpoint
+MAX_BATCH_SIZE = int(os.getenv("PREDICT_MAX_BATCH_SIZE", "1000"))
+
+# Number of rows scored together by bulk endpoint, memory usage is bounded by this regardless of upload size
+BULK_CHUNK_SIZE = int(os.getenv("PREDICT_BULK_CHUNK_SIZE", "1000"))
+
+# Bytes of bulk predictions kept in memory before they are spooled to temporary file
+BULK_SPOOL_SIZE = int(os.getenv("PREDICT_BULK_SPOOL_SIZE", str(8 * 1024 * 1024)))
+
+# Encoders were fitted on upper case categories, e.g. loan_grade 'c' is the same applicant as 'C'
+CATEGORICAL_FIELDS = [name for name, field in Prediction_Data.model_fields.items() if field.annotation is str]
+
+def canonicalize_record(data):
+    record = data.model_dump()
+    for field in CATEGORICAL_FIELDS:
+        record[field] = record[field].strip().upper()
+
+    return record
+
+def predict_record(record, artifact_set = None):
+    # Read the served artifact set once, so reload in the middle of request doesn't mix versions
+    if(artifact_set is None):
+        artifact_set = reloader.current
+
+    timer = metrics.stage_timer("single")
+
+    data = artifact_set.compiled_preprocessor.transform_record(record)
 
-    pred = model.predict(data)
+    if(timer is not None):
+        timer("preprocess")
+
+    if(artifact_set.compiled_tree is not None):
+        pred = [artifact_set.compiled_tree.predict_row(data[0])]
+
+    elif(artifact_set.sparse_transformer is not None):
+        pred = artifact_set.model.predict(sp.csr_matrix(data))
+
+    else:
+        data = pd.DataFrame(data, columns = artifact_set.compiled_preprocessor.columns)
+        pred = artifact_set.model.predict(data)
+
+    if(timer is not None):
+        timer("predict")
 
     if(pred[0] == 1):
         return {"result": "Default", "error_msg": ""}
@@ -48,6 +108,336 @@ def predict_data(data: Prediction_Data):
     else:
         return HTTPException(status_code = 400, detail = "Price must be greater than zero.")
 
+def predict_records(records, artifact_set = None):
+    if(artifact_set is None):
+        artifact_set = reloader.current
+
+    timer = metrics.stage_timer("batch")
+    if(timer is not None):
+        metrics.registry.observe("credit_scoring_batch_size", len(records))
+
+    # Memory-mapped artifacts have no sklearn objects, records are preprocessed by the compiled preprocessor
+    if(artifact_set.mode == "mmap"):
+        batch = artifact_set.compiled_preprocessor.transform_records(records)
+
+        if(timer is not None):
+            timer("preprocess")
+
+    # Preprocess all records in one pass
+    else:
+        batch = pd.DataFrame(records, columns = list(Prediction_Data.model_fields))
+
+        if(timer is not None):
+            timer("to_frame")
+
+        # Model fitted on sparse matrix predicts the CSR batch directly when there is no compiled tree
+        if(artifact_set.sparse_transformer is not None and artifact_set.compiled_tree is None):
+            batch = artifact_set.sparse_transformer.transform_sparse(batch)
+
+            if(timer is not None):
+                timer("preprocess")
+
+        else:
+            batch = preprocess_util.transform_preprocess_data(
+                X = batch,
+                num_imputer = artifact_set.num_imputer,
+                cat_imputer = artifact_set.cat_imputer,
+                ohe_encoder = artifact_set.ohe_encoder,
+                scaler = artifact_set.scaler,
+                timer = timer
+            )
+
+    if(artifact_set.compiled_tree is not None):
+        preds = artifact_set.compiled_tree.predict(np.asarray(batch))
+
+    else:
+        preds = artifact_set.model.predict(batch)
+
+    if(timer is not None):
+        timer("predict")
+
+    return format_predictions(preds)
+
+def format_predictions(preds):
+    results = []
+    for pred in preds:
+        if(pred == 1):
+            results.append({"result": "Default", "error_msg": ""})
+
+        elif(pred == 0):
+            results.append({"result": "Non Default", "error_msg": ""})
+
+        else:
+            results.append({"result": "", "error_msg": f"Unexpected prediction {pred}."})
+
+    return results
+
+def warmup_artifact_set(artifact_set):
+    # Test prediction through both single record and batch path before the artifact set is served
+    record = canonicalize_record(Prediction_Data())
+
+    predict_record(record, artifact_set = artifact_set)
+    predict_records([record], artifact_set = artifact_set)
+
+# Model and preprocessing artifacts, reloaded without restarting the API when newer version is available
+reloader = artifacts.ArtifactReloader(
+    backend = artifacts.create_backend(
+        source = os.getenv("ARTIFACT_SOURCE", "local"),
+        directory = os.getenv("ARTIFACT_DIR", "../models"),
+        bucket_name = os.getenv("ARTIFACT_BUCKET", "credit-scoring-service"),
+        endpoint_url = os.getenv("ARTIFACT_S3_ENDPOINT_URL")
+    ),
+    model_key = os.getenv("ARTIFACT_MODEL_KEY", "best_model.pkl"),
+    warmup = warmup_artifact_set,
+    poll_interval = float(os.getenv("ARTIFACT_POLL_INTERVAL", "0")),
+    mmap_dir = os.getenv("ARTIFACT_MMAP_DIR")
+)
+reloader.reload()
+reloader.start_polling()
+
+# Optional coalescing of concurrent /predict/ calls into one batch, trading a little latency for throughput
+coalescer = None
+if(os.getenv("PREDICT_COALESCE", "0") == "1"):
+    coalescer = PredictionCoalescer(
+        score_batch = predict_records,
+        max_wait_ms = float(os.getenv("PREDICT_COALESCE_MAX_WAIT_MS", "2")),
+        max_batch_size = int(os.getenv("PREDICT_COALESCE_MAX_BATCH_SIZE", "64"))
+    )
+
+# Optional cache of repeated applicant, invalidated whenever new artifacts are served
+cache = None
+if(int(os.getenv("PREDICT_CACHE_SIZE", "10000")) > 0):
+    cache = PredictionCache(
+        max_size = int(os.getenv("PREDICT_CACHE_SIZE", "10000")),
+        ttl = float(os.getenv("PREDICT_CACHE_TTL", "300"))
+    )
+    reloader.on_swap.append(cache.clear)
+
+@app.post("/predict/")
+async def predict_data(data: Prediction_Data):
+    record = canonicalize_record(data)
+
+    if(cache is not None):
+        key = cache.make_key(reloader.current.version, record)
+        result = cache.get(key)
+        if(result is not None):
+            return result
+
+    if(coalescer is not None):
+        result = await coalescer.submit(record)
+
+    else:
+        result = await run_in_threadpool(predict_record, record)
+
+    if(cache is not None and isinstance(result, dict)):
+        cache.put(key, result)
+
+    return result
+
+def format_validation_error(error):
+    messages = []
+    for err in error.errors():
+        if(len(err["loc"]) > 0):
+            messages.append(f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}")
+        else:
+            messages.append(err["msg"])
+
+    return "; ".join(messages)
+
+@app.post("/predict/batch")
+def predict_batch_data(data: Batch_Prediction_Data):
+    if(len(data.records) > MAX_BATCH_SIZE):
+        raise HTTPException(status_code = 413, detail = f"Batch contains {len(data.records)} records, maximum allowed is {MAX_BATCH_SIZE}.")
+
+    results = [{"result": "", "error_msg": ""} for _ in data.records]
+
+    # Validate each record separately so one invalid record doesn't reject the whole batch
+    valid_idx = []
+    valid_records = []
+    for i, record in enumerate(data.records):
+        try:
+            valid_records.append(canonicalize_record(Prediction_Data.model_validate(record)))
+            valid_idx.append(i)
+        except ValidationError as e:
+            results[i]["error_msg"] = format_validation_error(e)
+
+    if(metrics.ENABLED and len(valid_records) < len(data.records)):
+        metrics.registry.inc("credit_scoring_record_errors_total", (("endpoint", "/predict/batch"),), len(data.records) - len(valid_records))
+
+    if(len(valid_records) == 0):
+        return {"results": results}
+
+    for i, result in zip(valid_idx, predict_records(valid_records)):
+        results[i] = result
+
+    return {"results": results}
+
+def score_bulk_chunk(lines, first_row, input_format, header):
+    results = []
+    valid_idx = []
+    valid_records = []
+
+    if(input_format == "csv"):
+        rows = list(csv.reader(lines))
+
+    for i, line in enumerate(lines):
+        results.append({"row": first_row + i, "result": "", "error_msg": ""})
+
+        try:
+            if(input_format == "csv"):
+                if(len(rows[i]) != len(header)):
+                    results[i]["error_msg"] = f"Expected {len(header)} fields, but {len(rows[i])} fields are given."
+                    continue
+
+                record = dict(zip(header, rows[i]))
+
+            else:
+                record = json.loads(line)
+
+            valid_records.append(canonicalize_record(Prediction_Data.model_validate(record)))
+            valid_idx.append(i)
+
+        except ValidationError as e:
+            results[i]["error_msg"] = format_validation_error(e)
+
+        except ValueError as e:
+            results[i]["error_msg"] = f"Invalid JSON: {e}"
+
+    if(len(valid_records) > 0):
+        for i, result in zip(valid_idx, predict_records(valid_records)):
+            results[i].update(result)
+
+    return results
+
+async def read_lines(request):
+    # Split request body stream into lines without reading the whole body
+    remainder = b""
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+
+    if(len(remainder.strip()) > 0):
+        yield remainder.rstrip(b"\r").decode("utf-8")
+
+def write_bulk_results(output, results):
+    output.write("".join(json.dumps(result) + "\n" for result in results).encode("utf-8"))
+
+    return sum(1 for result in results if result.get("error_msg", "") != "")
+
+def iter_file(output, block_size = 1 << 16):
+    try:
+        while True:
+            block = output.read(block_size)
+            if(len(block) == 0):
+                break
+
+            yield block
+    finally:
+        output.close()
+
+@app.post("/predict/bulk")
+async def predict_bulk_data(request: Request):
+    content_type = request.headers.get("content-type", "")
+
+    if("csv" in content_type):
+        input_format = "csv"
+
+    elif("ndjson" in content_type or "jsonl" in content_type):
+        input_format = "ndjson"
+
+    else:
+        raise HTTPException(status_code = 415, detail = f"Content type 'text/csv' or 'application/x-ndjson' expected, but '{content_type}' is given.")
+
+    start = time.perf_counter()
+    header = None
+    n_rows = 0
+    n_errors = 0
+    lines = []
+
+    # Predictions are spooled to temporary file as each chunk is scored. Most HTTP clients send the whole body
+    # before reading the response, so answering while the body is still uploaded would block both sides.
+    output = tempfile.SpooledTemporaryFile(max_size = BULK_SPOOL_SIZE)
+
+    async for line in read_lines(request):
+        if(len(line.strip()) == 0):
+            continue
+
+        if(input_format == "csv" and header is None):
+            header = next(csv.reader([line]))
+            continue
+
+        lines.append(line)
+        if(len(lines) < BULK_CHUNK_SIZE):
+            continue
+
+        results = await run_in_threadpool(score_bulk_chunk, lines, n_rows, input_format, header)
+        n_errors += write_bulk_results(output, results)
+        n_rows += len(lines)
+        lines = []
+
+    if(len(lines) > 0):
+        results = await run_in_threadpool(score_bulk_chunk, lines, n_rows, input_format, header)
+        n_errors += write_bulk_results(output, results)
+        n_rows += len(lines)
+
+    elapsed = time.perf_counter() - start
+    rows_per_second = n_rows / elapsed if elapsed > 0 else 0.0
+
+    if(metrics.ENABLED):
+        metrics.registry.inc("credit_scoring_bulk_rows_total", (), n_rows)
+        metrics.registry.observe("credit_scoring_bulk_rows_per_second", rows_per_second)
+
+    write_bulk_results(output, [{"summary": {
+        "rows": n_rows,
+        "errors": n_errors,
+        "seconds": elapsed,
+        "rows_per_second": rows_per_second
+    }}])
+    output.seek(0)
+
+    return StreamingResponse(
+        iter_file(output),
+        media_type = "application/x-ndjson",
+        headers = {"X-Rows-Per-Second": f"{rows_per_second:.0f}"}
+    )
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False):
+    try:
+        reloaded = reloader.reload(force = force)
+    except Exception as e:
+        raise HTTPException(status_code = 500, detail = f"Reloading artifacts failed, keep serving version {reloader.current.version}: {e}")
+
+    return {"reloaded": reloaded, "version": reloader.current.version}
+
+@app.get("/admin/stats")
+def admin_stats():
+    return {
+        "artifacts": reloader.stats(),
+        "cache": cache.stats() if cache is not None else None,
+        "coalescer": coalescer.stats() if coalescer is not None else None
+    }
+
+@app.get("/metrics", response_class = PlainTextResponse)
+def metrics_data():
+    gauges = [(("credit_scoring_artifact_reloads", ()), reloader.n_reloads)]
+
+    if(cache is not None):
+        cache_stats = cache.stats()
+        gauges.append((("credit_scoring_cache_hits", ()), cache_stats["hits"]))
+        gauges.append((("credit_scoring_cache_misses", ()), cache_stats["misses"]))
+        gauges.append((("credit_scoring_cache_size", ()), cache_stats["size"]))
+
+    if(coalescer is not None):
+        coalescer_stats = coalescer.stats()
+        gauges.append((("credit_scoring_coalescer_requests", ()), coalescer_stats["requests"]))
+        gauges.append((("credit_scoring_coalescer_batches", ()), coalescer_stats["batches"]))
+
+    return PlainTextResponse(metrics.registry.render(gauges), media_type = "text/plain; version=0.0.4")
+
 @app.get("/health")
 def health_check():
     return {"result": "OK", "error_msg": ""}
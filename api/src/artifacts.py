@@ -0,0 +1,381 @@
+import os
+import re
+import json
+import time
+import joblib
+import shutil
+import hashlib
+import numpy as np
+import threading
+import tree_engine
+import preprocess_util
+from io import BytesIO
+
+# Feature pipeline bundle pushed by preprocess_credit_data, e.g. feature_pipeline_20221231.pkl,
+# older versions pushed four preprocessing artifacts, e.g. preprocess_ohe_20221231.pkl
+FEATURE_PIPELINE_KEY_PATTERN = re.compile(r"^feature_pipeline_(\d{8})\.pkl$")
+PREPROCESS_KEY_PATTERN = re.compile(r"^preprocess_(num_imputer|cat_imputer|ohe|scaler)_(\d{8})\.pkl$")
+PREPROCESS_NAMES = ["num_imputer", "cat_imputer", "ohe", "scaler"]
+
+class LocalArtifactBackend:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def list_keys(self):
+        # Token of each file changes whenever the file is rewritten
+        keys = {}
+        for entry in os.scandir(self.directory):
+            if(entry.is_file()):
+                stat = entry.stat()
+                keys[entry.name] = f"{stat.st_mtime_ns}-{stat.st_size}"
+
+        return keys
+
+    def load(self, key):
+        return joblib.load(os.path.join(self.directory, key))
+
+    def describe(self):
+        return f"local:{self.directory}"
+
+class MinioArtifactBackend:
+    def __init__(self, bucket_name, endpoint_url = None):
+        import boto3
+
+        self.bucket_name = bucket_name
+        self.client = boto3.client("s3", endpoint_url = endpoint_url)
+
+    def list_keys(self):
+        # ETag of each object changes whenever the object is rewritten
+        keys = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket = self.bucket_name):
+            for obj in page.get("Contents", []):
+                keys[obj["Key"]] = obj["ETag"]
+
+        return keys
+
+    def load(self, key):
+        body = self.client.get_object(Bucket = self.bucket_name, Key = key)["Body"].read()
+        return joblib.load(BytesIO(body))
+
+    def describe(self):
+        return f"minio:{self.bucket_name}"
+
+def create_backend(source, directory, bucket_name, endpoint_url = None):
+    if(source == "local"):
+        return LocalArtifactBackend(directory = directory)
+
+    elif(source == "minio"):
+        return MinioArtifactBackend(bucket_name = bucket_name, endpoint_url = endpoint_url)
+
+    else:
+        raise RuntimeError(f"The parameter 'source' expected 'local' or 'minio', but {str(source)} is given.")
+
+class ArtifactSet:
+    # Model and preprocessing artifacts that were trained together, never mixed with other version.
+    # Set loaded from memory-mapped arrays has no sklearn objects, only the compiled preprocessor and tree.
+    # Model trained on sparse matrix also gets the sparse transformer, so batches of model.predict are never densified.
+    def __init__(self, version, compiled_preprocessor, compiled_tree,
+                 model = None, num_imputer = None, cat_imputer = None, ohe_encoder = None, scaler = None,
+                 sparse_transformer = None, preprocess_version = None):
+        self.version = version
+        self.preprocess_version = preprocess_version
+        self.compiled_preprocessor = compiled_preprocessor
+        self.compiled_tree = compiled_tree
+        self.sparse_transformer = sparse_transformer
+
+        self.model = model
+        self.num_imputer = num_imputer
+        self.cat_imputer = cat_imputer
+        self.ohe_encoder = ohe_encoder
+        self.scaler = scaler
+
+        self.mode = "pickle" if model is not None else "mmap"
+
+def build_artifact_set(version, model, num_imputer, cat_imputer, ohe_encoder, scaler, preprocess_version = None):
+    # Fast path for single record, built once from the fitted artifacts
+    compiled_preprocessor = preprocess_util.compile_preprocess_data(
+        num_imputer = num_imputer,
+        cat_imputer = cat_imputer,
+        ohe_encoder = ohe_encoder,
+        scaler = scaler
+    )
+
+    # Array based evaluator of the tree, None when model isn't supported tree and model.predict is used
+    try:
+        compiled_tree = tree_engine.compile_tree(model)
+    except Exception as e:
+        print(f"Compiling tree failed, model.predict is used instead: {e}")
+        compiled_tree = None
+
+    # Training records whether the model was fitted on sparse matrix, older model is served densely
+    if(getattr(model, "sparse_input_", False)):
+        sparse_transformer = preprocess_util.fuse_preprocess_data(
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+    else:
+        sparse_transformer = None
+
+    return ArtifactSet(
+        version = version,
+        compiled_preprocessor = compiled_preprocessor,
+        compiled_tree = compiled_tree,
+        model = model,
+        num_imputer = num_imputer,
+        cat_imputer = cat_imputer,
+        ohe_encoder = ohe_encoder,
+        scaler = scaler,
+        sparse_transformer = sparse_transformer,
+        preprocess_version = preprocess_version
+    )
+
+def save_params(params, directory, prefix, manifest):
+    # NumPy arrays go to uncompressed .npy files, everything else to the manifest
+    for name, value in params.items():
+        if(isinstance(value, np.ndarray) and value.ndim > 0):
+            if(value.dtype == object):
+                value = value.astype(str)
+
+            np.save(os.path.join(directory, f"{prefix}_{name}.npy"), value)
+            manifest[prefix]["arrays"].append(name)
+
+        elif(isinstance(value, list) and len(value) > 0 and isinstance(value[0], np.ndarray)):
+            for i, array in enumerate(value):
+                np.save(os.path.join(directory, f"{prefix}_{name}_{i}.npy"), array.astype(str) if array.dtype == object else array)
+
+            manifest[prefix]["array_lists"][name] = len(value)
+
+        else:
+            manifest[prefix]["values"][name] = value.item() if isinstance(value, np.ndarray) else value
+
+def load_params(directory, prefix, manifest):
+    params = dict(manifest[prefix]["values"])
+
+    for name in manifest[prefix]["arrays"]:
+        params[name] = np.load(os.path.join(directory, f"{prefix}_{name}.npy"), mmap_mode = "r")
+
+    for name, length in manifest[prefix]["array_lists"].items():
+        params[name] = [np.load(os.path.join(directory, f"{prefix}_{name}_{i}.npy"), mmap_mode = "r") for i in range(length)]
+
+    return params
+
+def export_mmap_artifacts(artifact_set, directory):
+    # Written to temporary directory then renamed, so other worker never maps half written files
+    tmp_directory = f"{directory}.tmp-{os.getpid()}"
+    os.makedirs(tmp_directory, exist_ok = True)
+
+    manifest = {"version": artifact_set.version, "preprocess_version": artifact_set.preprocess_version}
+    for prefix, params in [("preprocess", artifact_set.compiled_preprocessor.params),
+                           ("tree", artifact_set.compiled_tree.params)]:
+        manifest[prefix] = {"arrays": [], "array_lists": {}, "values": {}}
+        save_params(params, tmp_directory, prefix, manifest)
+
+    with open(os.path.join(tmp_directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    try:
+        os.rename(tmp_directory, directory)
+    except OSError:
+        # Other worker exported the same version first
+        shutil.rmtree(tmp_directory, ignore_errors = True)
+
+def load_mmap_artifact_set(directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    return ArtifactSet(
+        version = manifest["version"],
+        preprocess_version = manifest.get("preprocess_version"),
+        compiled_preprocessor = preprocess_util.CompiledPreprocessor(load_params(directory, "preprocess", manifest)),
+        compiled_tree = tree_engine.CompiledTree(load_params(directory, "tree", manifest))
+    )
+
+def is_preprocess_key(key):
+    return PREPROCESS_KEY_PATTERN.match(key) is not None or FEATURE_PIPELINE_KEY_PATTERN.match(key) is not None
+
+def find_preprocess_keys(keys, preprocess_version = None, bundle = False):
+    # Model recording feature pipeline hash is only served with a bundle, older model only with the four artifacts,
+    # so a bundle written by a later run never attaches to older model
+    if(bundle):
+        complete = {}
+        for key in keys:
+            match = FEATURE_PIPELINE_KEY_PATTERN.match(key)
+            if(match):
+                complete[match.group(1)] = {"feature_pipeline": key}
+
+    else:
+        # Group preprocessing artifacts by their date, only complete group is usable
+        groups = {}
+        for key in keys:
+            match = PREPROCESS_KEY_PATTERN.match(key)
+            if(match):
+                groups.setdefault(match.group(2), {})[match.group(1)] = key
+
+        complete = {date: group for date, group in groups.items() if all(name in group for name in PREPROCESS_NAMES)}
+
+    if(preprocess_version is None):
+        if(len(complete) == 0):
+            raise RuntimeError("No complete set of preprocessing artifacts is found.")
+
+        preprocess_version = max(complete)
+
+    if(preprocess_version not in complete):
+        raise RuntimeError(f"Preprocessing artifacts of version '{preprocess_version}' are incomplete or missing.")
+
+    return preprocess_version, complete[preprocess_version]
+
+class ArtifactReloader:
+    # Load new artifact set in background, warm it up, then swap it in with one assignment.
+    # Requests read 'current' once and keep using that set, so they never see mixed versions.
+    def __init__(self, backend, model_key = "best_model.pkl", warmup = None, poll_interval = 0, mmap_dir = None):
+        self.backend = backend
+        self.mmap_dir = mmap_dir
+        self.model_key = model_key
+        self.warmup = warmup
+        self.poll_interval = poll_interval
+
+        self.current = None
+        self.fingerprint = None
+        self.on_swap = []
+
+        # Preprocessing version each served model was first served with, by token of the model artifact
+        self.pinned_versions = {}
+
+        self.lock = threading.Lock()
+        self.poller = None
+
+        self.n_reloads = 0
+        self.last_error = ""
+
+    def list_fingerprint(self):
+        keys = self.backend.list_keys()
+        if(self.model_key not in keys):
+            raise RuntimeError(f"Model artifact '{self.model_key}' is not found in {self.backend.describe()}.")
+
+        return {key: token for key, token in keys.items() if key == self.model_key or is_preprocess_key(key)}
+
+    def load_preprocess_artifacts(self, model, preprocess_keys):
+        # Bundle is read in one round trip, its hash must be the one recorded by training
+        if("feature_pipeline" in preprocess_keys):
+            feature_pipeline = preprocess_util.FeaturePipeline.from_bundle(self.backend.load(preprocess_keys["feature_pipeline"]))
+
+            if(model.feature_pipeline_hash_ != feature_pipeline.hash):
+                raise RuntimeError(f"Model expected feature pipeline {model.feature_pipeline_hash_}, but {preprocess_keys['feature_pipeline']} is {feature_pipeline.hash}.")
+
+            return feature_pipeline.artifacts()
+
+        return tuple(self.backend.load(preprocess_keys[name]) for name in PREPROCESS_NAMES)
+
+    def load(self, fingerprint, force = False):
+        model = self.backend.load(self.model_key)
+
+        # Training records the preprocessing version of the model. Older model takes the newest complete set only
+        # when it is served for the first time, then it stays pinned to that set, and the reload fails and keeps
+        # the current set when the pinned set is gone.
+        preprocess_version = getattr(model, "preprocess_version_", None)
+        if(preprocess_version is None):
+            preprocess_version = self.pinned_versions.get(fingerprint[self.model_key])
+
+        preprocess_version, preprocess_keys = find_preprocess_keys(
+            keys = fingerprint,
+            preprocess_version = preprocess_version,
+            bundle = hasattr(model, "feature_pipeline_hash_")
+        )
+
+        version = f"{preprocess_version}-{fingerprint[self.model_key]}"
+        if(not force and self.current is not None and self.current.version == version):
+            return None
+
+        num_imputer, cat_imputer, ohe_encoder, scaler = self.load_preprocess_artifacts(model, preprocess_keys)
+
+        return build_artifact_set(
+            version = version,
+            model = model,
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler,
+            preprocess_version = preprocess_version
+        )
+
+    def load_mmap(self, fingerprint, force = False):
+        # Workers sharing mmap_dir export each version once, then map the same files through page cache
+        # Pinned version is part of the name, worker with pinned older model never maps export of other worker
+        # that paired the model with a newer set
+        pinned_version = self.pinned_versions.get(fingerprint[self.model_key])
+        digest = hashlib.sha256(json.dumps([fingerprint, pinned_version], sort_keys = True).encode()).hexdigest()[:16]
+        directory = os.path.join(self.mmap_dir, digest)
+
+        if(not os.path.exists(directory)):
+            artifact_set = self.load(fingerprint, force = True)
+            if(artifact_set.compiled_tree is None):
+                print("Model isn't supported by compiled tree, artifacts are served without memory mapping.")
+                return artifact_set
+
+            os.makedirs(self.mmap_dir, exist_ok = True)
+            export_mmap_artifacts(artifact_set, directory)
+
+        artifact_set = load_mmap_artifact_set(directory)
+        if(not force and self.current is not None and self.current.version == artifact_set.version):
+            return None
+
+        return artifact_set
+
+    def reload(self, force = False):
+        with self.lock:
+            fingerprint = self.list_fingerprint()
+            if(not force and fingerprint == self.fingerprint):
+                return False
+
+            if(self.mmap_dir is not None):
+                artifact_set = self.load_mmap(fingerprint, force = force)
+            else:
+                artifact_set = self.load(fingerprint, force = force)
+            if(artifact_set is None):
+                self.fingerprint = fingerprint
+                return False
+
+            # Test prediction before serving, broken artifacts raise here and the current set is kept
+            if(self.warmup is not None):
+                self.warmup(artifact_set)
+
+            self.current = artifact_set
+            self.fingerprint = fingerprint
+            self.n_reloads += 1
+            self.pinned_versions.setdefault(fingerprint[self.model_key], artifact_set.preprocess_version)
+
+        print(f"Artifacts version {artifact_set.version} from {self.backend.describe()} is now served.")
+
+        for callback in self.on_swap:
+            callback(artifact_set)
+
+        return True
+
+    def poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+
+            try:
+                self.reload()
+                self.last_error = ""
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Reloading artifacts failed, keep serving version {self.current.version}: {e}")
+
+    def start_polling(self):
+        if(self.poll_interval > 0 and self.poller is None):
+            self.poller = threading.Thread(target = self.poll, name = "artifact-reloader", daemon = True)
+            self.poller.start()
+
+    def stats(self):
+        return {
+            "source": self.backend.describe(),
+            "version": self.current.version if self.current is not None else None,
+            "mode": self.current.mode if self.current is not None else None,
+            "reloads": self.n_reloads,
+            "poll_interval": self.poll_interval,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,88 @@
+import asyncio
+from collections import Counter
+from starlette.concurrency import run_in_threadpool
+
+class PredictionCoalescer:
+    # Queue concurrent single record requests and score them together as one batch.
+    # Batch is closed when it reaches max_batch_size or max_wait_ms passed since its first record.
+    def __init__(self, score_batch, max_wait_ms = 2.0, max_batch_size = 64):
+        if(max_batch_size < 1):
+            raise RuntimeError(f"The parameter 'max_batch_size' expected at least 1, but {max_batch_size} is given.")
+
+        self.score_batch = score_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self.loop = None
+        self.queue = None
+        self.worker = None
+
+        self.n_requests = 0
+        self.n_batches = 0
+        self.batch_size_count = Counter()
+
+    def start(self):
+        # Queue and worker belong to the running event loop, recreate them if the loop changed
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.worker = self.loop.create_task(self.run())
+
+    async def submit(self, record):
+        if(self.worker is None or self.worker.done() or self.loop is not asyncio.get_running_loop()):
+            self.start()
+
+        future = self.loop.create_future()
+        self.queue.put_nowait((record, future))
+
+        return await future
+
+    async def collect(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+
+        while(len(batch) < self.max_batch_size):
+            if(not self.queue.empty()):
+                batch.append(self.queue.get_nowait())
+                continue
+
+            timeout = deadline - self.loop.time()
+            if(timeout <= 0):
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.collect()
+            records = [record for record, _ in batch]
+
+            self.n_requests += len(batch)
+            self.n_batches += 1
+            self.batch_size_count[len(batch)] += 1
+
+            try:
+                results = await run_in_threadpool(self.score_batch, records)
+            except Exception as e:
+                for _, future in batch:
+                    if(not future.done()):
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if(not future.done()):
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "requests": self.n_requests,
+            "batches": self.n_batches,
+            "mean_batch_size": self.n_requests / self.n_batches if self.n_batches > 0 else 0.0,
+            "batch_size_count": dict(sorted(self.batch_size_count.items()))
+        }
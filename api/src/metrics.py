@@ -0,0 +1,137 @@
+import os
+import time
+import bisect
+import threading
+
+# Instrumentation switch, when disabled no timer is created and nothing is recorded in hot paths
+ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Upper bounds of histogram buckets, the same in every worker, so Prometheus sums the buckets of all workers
+# and computes quantiles with histogram_quantile
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+THROUGHPUT_BUCKETS = [1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000]
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        # Value equal to upper bound belongs to that bucket, value above every bound is only in +Inf
+        i = bisect.bisect_left(self.buckets, value)
+        if(i < len(self.buckets)):
+            self.counts[i] += 1
+
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield str(bound), total
+
+        yield "+Inf", self.count
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.buckets = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def describe(self, name, text, buckets = None):
+        self.help[name] = text
+        if(buckets is not None):
+            self.buckets[name] = buckets
+
+    def inc(self, name, labels = (), value = 1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def observe(self, name, value, labels = ()):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if(histogram is None):
+                histogram = self.histograms[(name, labels)] = Histogram(self.buckets.get(name, LATENCY_BUCKETS))
+
+            histogram.observe(value)
+
+    def render(self, gauges = ()):
+        # Prometheus text exposition format
+        lines = []
+
+        with self.lock:
+            for name, labels_values in group_by_name(self.counters.items()):
+                lines.extend(header(name, "counter", self.help.get(name)))
+                for labels, value in labels_values:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+            for name, labels_histograms in group_by_name(self.histograms.items()):
+                lines.extend(header(name, "histogram", self.help.get(name)))
+                for labels, histogram in labels_histograms:
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for name, labels_values in group_by_name(gauges):
+            lines.extend(header(name, "gauge", self.help.get(name)))
+            for labels, value in labels_values:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+def group_by_name(items):
+    groups = {}
+    for (name, labels), value in items:
+        groups.setdefault(name, []).append((labels, value))
+
+    return sorted(groups.items())
+
+def header(name, metric_type, text):
+    lines = []
+    if(text is not None):
+        lines.append(f"# HELP {name} {text}")
+
+    lines.append(f"# TYPE {name} {metric_type}")
+
+    return lines
+
+def format_labels(labels):
+    if(len(labels) == 0):
+        return ""
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+registry = Registry()
+registry.describe("credit_scoring_requests_total", "Number of HTTP requests.")
+registry.describe("credit_scoring_errors_total", "Number of HTTP requests answered with error status.")
+registry.describe("credit_scoring_record_errors_total", "Number of records rejected by validation inside batch requests.")
+registry.describe("credit_scoring_request_seconds", "Latency of HTTP requests.", LATENCY_BUCKETS)
+registry.describe("credit_scoring_stage_seconds", "Latency of each scoring stage.", LATENCY_BUCKETS)
+registry.describe("credit_scoring_batch_size", "Number of records scored together in one batch.", SIZE_BUCKETS)
+registry.describe("credit_scoring_bulk_rows_total", "Number of rows scored by bulk endpoint.")
+registry.describe("credit_scoring_bulk_rows_per_second", "Throughput of each bulk scoring request.", THROUGHPUT_BUCKETS)
+
+class StageTimer:
+    # Each call records the time since previous call as the latency of the named stage
+    def __init__(self, path):
+        self.path = path
+        self.last = time.perf_counter()
+
+    def __call__(self, stage):
+        now = time.perf_counter()
+        registry.observe("credit_scoring_stage_seconds", now - self.last, (("path", self.path), ("stage", stage)))
+        self.last = now
+
+def stage_timer(path):
+    if(ENABLED):
+        return StageTimer(path)
+
+    return None
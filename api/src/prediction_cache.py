@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import OrderedDict
+
+class PredictionCache:
+    # Bounded LRU of prediction results with time to live.
+    # Key contains the artifacts version, so result of older model is never returned after reload.
+    def __init__(self, max_size = 10000, ttl = 300.0):
+        if(max_size < 1):
+            raise RuntimeError(f"The parameter 'max_size' expected at least 1, but {max_size} is given.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+        self.n_expirations = 0
+        self.n_invalidations = 0
+
+    def make_key(self, version, record):
+        return (version, tuple(sorted(record.items())))
+
+    def get(self, key):
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is None):
+                self.n_misses += 1
+                return None
+
+            expires_at, result = entry
+            if(expires_at <= now):
+                del self.entries[key]
+                self.n_expirations += 1
+                self.n_misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.n_hits += 1
+
+        return dict(result)
+
+    def put(self, key, result):
+        expires_at = time.monotonic() + self.ttl
+
+        with self.lock:
+            self.entries[key] = (expires_at, dict(result))
+            self.entries.move_to_end(key)
+
+            while(len(self.entries) > self.max_size):
+                self.entries.popitem(last = False)
+                self.n_evictions += 1
+
+    def clear(self, *args):
+        with self.lock:
+            self.entries.clear()
+            self.n_invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.n_hits + self.n_misses
+
+            return {
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "size": len(self.entries),
+                "hits": self.n_hits,
+                "misses": self.n_misses,
+                "hit_rate": self.n_hits / lookups if lookups > 0 else 0.0,
+                "evictions": self.n_evictions,
+                "expirations": self.n_expirations,
+                "invalidations": self.n_invalidations
+            }
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+
+TREE_LEAF = -1
+
+def export_tree(model):
+    # Flat arrays of the fitted tree, enough to evaluate it without sklearn
+    tree = model.tree_
+
+    children_left = np.array(tree.children_left, dtype = np.intp)
+    children_right = np.array(tree.children_right, dtype = np.intp)
+    feature = np.array(tree.feature, dtype = np.intp)
+    threshold = np.array(tree.threshold, dtype = np.float64)
+
+    # Older sklearn doesn't store where missing values go, NaN <= threshold is False so it goes right
+    if(hasattr(tree, "missing_go_to_left")):
+        missing_go_to_left = np.array(tree.missing_go_to_left, dtype = bool)
+    else:
+        missing_go_to_left = np.zeros(tree.node_count, dtype = bool)
+
+    # Leaf loops back to itself, so a row already on leaf stays there during batch traversal
+    is_leaf = children_left == TREE_LEAF
+    node_id = np.arange(tree.node_count, dtype = np.intp)
+    children_left[is_leaf] = node_id[is_leaf]
+    children_right[is_leaf] = node_id[is_leaf]
+    feature[is_leaf] = 0
+
+    return {
+        "children_left": children_left,
+        "children_right": children_right,
+        "feature": feature,
+        "threshold": threshold,
+        "missing_go_to_left": missing_go_to_left,
+        "is_leaf": is_leaf,
+        "leaf_class": np.argmax(tree.value[:, 0, :], axis = 1).astype(np.intp),
+        "classes": np.asarray(model.classes_),
+        "max_depth": np.array(tree.max_depth, dtype = np.intp),
+        "n_features": np.array(model.n_features_in_, dtype = np.intp)
+    }
+
+class CompiledTree:
+    # Same decision as DecisionTreeClassifier.predict, features are rounded to float32 like sklearn does
+    def __init__(self, params):
+        self.params = params
+
+        self.children_left = params["children_left"]
+        self.children_right = params["children_right"]
+        self.feature = params["feature"]
+        self.threshold = params["threshold"]
+        self.missing_go_to_left = params["missing_go_to_left"]
+        self.is_leaf = params["is_leaf"]
+        self.leaf_class = params["leaf_class"]
+        self.classes = params["classes"]
+        self.max_depth = int(params["max_depth"])
+        self.n_features = int(params["n_features"])
+
+        # Single row traversal reads the arrays through memoryview, which gives Python scalars like a list does
+        # but doesn't copy the arrays, so memory mapped arrays stay shared between workers
+        self.row_view = tuple(
+            memoryview(np.ascontiguousarray(array))
+            for array in (self.is_leaf, self.feature, self.threshold, self.children_left, self.children_right,
+                          self.missing_go_to_left, self.leaf_class)
+        )
+
+    def apply(self, X):
+        X = np.ascontiguousarray(X, dtype = np.float32)
+        if(X.ndim != 2 or X.shape[1] != self.n_features):
+            raise RuntimeError(f"Expected input with {self.n_features} features, but shape {X.shape} is given.")
+
+        X_flat = X.ravel()
+        node = np.zeros(X.shape[0], dtype = np.intp)
+
+        # Rows still on split node, shrinks every level as rows reach their leaf
+        active = np.arange(X.shape[0])
+        offset = active * self.n_features
+
+        for _ in range(self.max_depth):
+            current = node[active]
+            value = X_flat[offset + self.feature[current]]
+            go_left = np.where(np.isnan(value), self.missing_go_to_left[current], value <= self.threshold[current])
+            current = np.where(go_left, self.children_left[current], self.children_right[current])
+            node[active] = current
+
+            not_leaf = ~self.is_leaf[current]
+            if(not not_leaf.all()):
+                active = active[not_leaf]
+                offset = offset[not_leaf]
+                if(active.size == 0):
+                    break
+
+        return node
+
+    def predict(self, X):
+        return self.classes[self.leaf_class[self.apply(X)]]
+
+    def predict_row(self, row):
+        row = np.asarray(row, dtype = np.float32).tolist()
+
+        is_leaf, feature, threshold, children_left, children_right, missing_go_to_left, leaf_class = self.row_view
+
+        node = 0
+        while not is_leaf[node]:
+            value = row[feature[node]]
+            if(value != value):
+                go_left = missing_go_to_left[node]
+            else:
+                go_left = value <= threshold[node]
+
+            node = children_left[node] if go_left else children_right[node]
+
+        i = leaf_class[node]
+        return self.classes[i:i + 1].tolist()[0]
+
+def probe_inputs(params, n_rows = 2048, random_state = 0):
+    # Every feature takes values exactly at, right below, and right above the thresholds, and NaN
+    rng = np.random.default_rng(random_state)
+    n_features = int(params["n_features"])
+    X = np.zeros((n_rows, n_features), dtype = np.float32)
+
+    split_node = ~params["is_leaf"]
+    for j in range(n_features):
+        thresholds = params["threshold"][split_node & (params["feature"] == j)].astype(np.float32)
+        candidates = np.concatenate((
+            thresholds,
+            np.nextafter(thresholds, np.float32(-np.inf)),
+            np.nextafter(thresholds, np.float32(np.inf)),
+            np.array([np.nan, 0.0], dtype = np.float32)
+        ))
+        X[:, j] = rng.choice(candidates, size = n_rows)
+
+    return X
+
+def compile_tree(model, X_check = None):
+    # Only single output DecisionTreeClassifier is supported, others keep using model.predict
+    if(not isinstance(model, DecisionTreeClassifier) or model.n_outputs_ != 1):
+        return None
+
+    compiled_tree = CompiledTree(export_tree(model))
+
+    # Verify against sklearn before the compiled tree is used
+    if(X_check is None):
+        X_check = probe_inputs(compiled_tree.params)
+
+    X_frame = X_check
+    if(hasattr(model, "feature_names_in_")):
+        X_frame = pd.DataFrame(X_check, columns = model.feature_names_in_)
+
+    expected = model.predict(X_frame)
+    if(not np.array_equal(compiled_tree.predict(X_check), expected)):
+        raise RuntimeError("Compiled tree predictions differ from model.predict.")
+
+    if(any(compiled_tree.predict_row(row) != pred for row, pred in zip(X_check[:256], expected[:256]))):
+        raise RuntimeError("Compiled tree single row predictions differ from model.predict.")
+
+    return compiled_tree
@@ -0,0 +1,46 @@
+# Time of preprocessing one record with transform_preprocess_data and with CompiledPreprocessor.transform_record,
+# run from the repository root: python benchmarks/bench_compiled_preprocessor.py
+import os
+import sys
+import time
+import joblib
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api", "src"))
+
+import preprocess_util
+
+RECORD = {
+    "person_age": 25,
+    "person_income": 50000,
+    "person_home_ownership": "RENT",
+    "person_emp_length": 3.0,
+    "loan_intent": "EDUCATION",
+    "loan_grade": "B",
+    "loan_amnt": 8000,
+    "loan_int_rate": 11.0,
+    "loan_percent_income": 0.16,
+    "cb_person_default_on_file": "N",
+    "cb_person_cred_hist_length": 4
+}
+
+def per_call(function, n_calls):
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        function()
+
+    return (time.perf_counter() - start) / n_calls
+
+if __name__ == "__main__":
+    artifacts = tuple(
+        joblib.load(os.path.join(ROOT_DIR, "api", "models", f"preprocess_{name}_20221231.pkl"))
+        for name in ["num_imputer", "cat_imputer", "ohe", "scaler"]
+    )
+    compiled = preprocess_util.compile_preprocess_data(*artifacts)
+
+    pandas_time = per_call(lambda: preprocess_util.transform_preprocess_data(pd.DataFrame([RECORD]), *artifacts), 500)
+    compiled_time = per_call(lambda: compiled.transform_record(RECORD), 50000)
+
+    print(f"transform_preprocess_data {pandas_time * 1e6:.1f} us per record")
+    print(f"CompiledPreprocessor.transform_record {compiled_time * 1e6:.2f} us per record ({pandas_time / compiled_time:.0f}x)")
@@ -0,0 +1,73 @@
+# Size, push time, pull time, and pull time of 3 columns of preprocessed train, valid, and test set stored in MinIO
+# as pkl, parquet, and arrow, each uncompressed and compressed whole with zstd and lz4. Needs the packages of the
+# Airflow image with zstandard and lz4, and the Airflow connection 'minio-conn', run from the repository root:
+# python benchmarks/bench_dataset_formats.py [n_rows]
+import os
+import sys
+import time
+import joblib
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api", "src"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "dags"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
+
+import preprocess_util
+from bench_fused_transformer import generate_rows
+from credit_scoring_service.utils import utils, client_registry
+
+BUCKET_NAME = "credit-scoring-service"
+PREFIX = "benchmark_dataset_formats"
+FORMATS = [f"{object_type}{compression}" for object_type in ["pkl", "parquet", "arrow"] for compression in ["", ".zst", ".lz4"]]
+
+def make_sets(n_rows):
+    # Train, valid, and test set transformed with the shipped artifacts, split 80/10/10 like preprocessing does
+    artifacts = tuple(
+        joblib.load(os.path.join(ROOT_DIR, "api", "models", f"preprocess_{name}_20221231.pkl"))
+        for name in ["num_imputer", "cat_imputer", "ohe", "scaler"]
+    )
+    X = preprocess_util.transform_preprocess_data(generate_rows(n_rows), *artifacts)
+    y = pd.Series(np.random.default_rng(0).integers(0, 2, n_rows), index = X.index, name = "loan_status")
+
+    bounds = [0, int(n_rows * 0.8), int(n_rows * 0.9), n_rows]
+    return {
+        role: (X.iloc[start:end], y.iloc[start:end])
+        for role, start, end in zip(["trainset", "validset", "testset"], bounds[:-1], bounds[1:])
+    }
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    sets = make_sets(n_rows)
+    columns = list(sets["trainset"][0].columns[:3])
+    s3 = client_registry.registry.s3_hook("minio-conn")
+
+    print(f"{'format':<12}{'size':>12}{'push':>10}{'pull':>10}{'pull 3 columns':>16}")
+    for dataset_format in FORMATS:
+        keys = {role: f"{PREFIX}/preprocess_{role}.{dataset_format}" for role in sets}
+
+        start = time.perf_counter()
+        for role, (X, y) in sets.items():
+            utils.minio_do(method = "push", key = keys[role], bucket_name = BUCKET_NAME, data = utils.pack_dataset(X = X, y = y, key = keys[role]))
+        push_time = time.perf_counter() - start
+
+        size = sum(s3.head_object(key = key, bucket_name = BUCKET_NAME)["ContentLength"] for key in keys.values())
+
+        start = time.perf_counter()
+        for key in keys.values():
+            utils.unpack_dataset(utils.minio_do(method = "pull", key = key, bucket_name = BUCKET_NAME))
+        pull_time = time.perf_counter() - start
+
+        # Pickle is always loaded whole, only columnar formats read some columns
+        projected = "-"
+        if(not dataset_format.startswith("pkl")):
+            start = time.perf_counter()
+            for key in keys.values():
+                utils.minio_do(method = "pull", key = key, bucket_name = BUCKET_NAME, columns = columns)
+            projected = f"{time.perf_counter() - start:.2f} s"
+
+        utils.minio_do(method = "delete", key = list(keys.values()), bucket_name = BUCKET_NAME)
+
+        print(f"{dataset_format:<12}{size / 1e6:>9.1f} MB{push_time:>8.2f} s{pull_time:>8.2f} s{projected:>16}")
@@ -0,0 +1,48 @@
+# Rows per second of extracting data_credit into Arrow tables with the 'cursor' and the 'copy' backend,
+# and whether both backends produce the same tables. Needs the packages of the Airflow image (the DAG utils
+# import airflow) and a database holding data_credit, run from the repository root:
+# python benchmarks/bench_extraction_backend.py [dsn] [n_rows]
+# e.g. python benchmarks/bench_extraction_backend.py "host=localhost user=postgres dbname=postgres" 1000000
+import os
+import sys
+import time
+import psycopg2
+import pyarrow as pa
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "dags"))
+
+from credit_scoring_service.utils import extraction_util
+
+CHUNK_SIZE = 50000
+
+def extract(dsn, query, backend):
+    connection = psycopg2.connect(dsn)
+    try:
+        start = time.perf_counter()
+        tables = list(extraction_util.query_tables(connection = connection, query = query, chunk_size = CHUNK_SIZE, backend = backend))
+        elapsed = time.perf_counter() - start
+    finally:
+        connection.close()
+
+    return tables, elapsed
+
+if __name__ == "__main__":
+    # Empty DSN takes the connection from libpq environment variables, e.g. PGHOST, PGUSER, and PGDATABASE
+    dsn = sys.argv[1] if len(sys.argv) > 1 else ""
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+
+    query = f"SELECT * FROM data_credit ORDER BY created_at ASC, id ASC LIMIT {n_rows};"
+
+    # Each backend runs twice, the first run also warms up the page cache of the database
+    results = {}
+    for backend in ["cursor", "copy", "cursor", "copy"]:
+        tables, elapsed = extract(dsn, query, backend)
+        n_extracted = sum(table.num_rows for table in tables)
+        print(f"{backend}: {n_extracted} rows in {len(tables)} tables, {elapsed:.2f} s, {n_extracted / elapsed:,.0f} rows/s")
+
+        results[backend] = tables
+
+    cursor_table = pa.concat_tables(results["cursor"])
+    copy_table = pa.concat_tables(results["copy"])
+    print(f"Same schema: {cursor_table.schema == copy_table.schema}, same rows: {cursor_table.equals(copy_table)}")
@@ -0,0 +1,70 @@
+# Time and peak of memory allocated while transforming a large DataFrame with transform_preprocess_data and with
+# FusedTransformer.transform_frame at float64 and float32, on the shipped 20221231 artifacts and generated rows,
+# run from the repository root: python benchmarks/bench_fused_transformer.py [n_rows]
+import os
+import sys
+import time
+import joblib
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "api", "src"))
+
+import preprocess_util
+
+CATEGORIES = {
+    "person_home_ownership": ["RENT", "OWN", "MORTGAGE", "OTHER"],
+    "loan_intent": ["PERSONAL", "EDUCATION", "MEDICAL", "VENTURE", "HOMEIMPROVEMENT", "DEBTCONSOLIDATION"],
+    "loan_grade": ["A", "B", "C", "D", "E", "F", "G"],
+    "cb_person_default_on_file": ["Y", "N"]
+}
+
+def generate_rows(n_rows, random_state = 0):
+    # Columns of data_credit with 2% missing values in every column
+    rng = np.random.default_rng(random_state)
+
+    X = pd.DataFrame({col: rng.uniform(0, 100, n_rows) for col in preprocess_util.NUMERICAL_COL})
+    for col, values in CATEGORIES.items():
+        X[col] = rng.choice(np.array(values, dtype = object), size = n_rows)
+
+    for col in X.columns:
+        X.loc[rng.random(n_rows) < 0.02, col] = np.nan
+
+    return X
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return output, elapsed, peak
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    artifacts = tuple(
+        joblib.load(os.path.join(ROOT_DIR, "api", "models", f"preprocess_{name}_20221231.pkl"))
+        for name in ["num_imputer", "cat_imputer", "ohe", "scaler"]
+    )
+    X = generate_rows(n_rows)
+    print(f"Input {n_rows} rows, {X.memory_usage(deep = True).sum() / 2 ** 20:.1f} MiB")
+
+    runs = {
+        "transform_preprocess_data": lambda: preprocess_util.transform_preprocess_data(X, *artifacts),
+        "FusedTransformer float64": lambda: preprocess_util.fuse_preprocess_data(*artifacts, dtype = np.float64).transform_frame(X),
+        "FusedTransformer float32": lambda: preprocess_util.fuse_preprocess_data(*artifacts, dtype = np.float32).transform_frame(X)
+    }
+
+    outputs = {}
+    for name, function in runs.items():
+        outputs[name], elapsed, peak = measure(function)
+        print(f"{name}: {elapsed:.2f} s, peak {peak / 2 ** 20:.1f} MiB allocated, output {outputs[name].memory_usage().sum() / 2 ** 20:.1f} MiB")
+
+    expected = outputs["transform_preprocess_data"].to_numpy()
+    print(f"float64 identical: {np.array_equal(outputs['FusedTransformer float64'].to_numpy(), expected, equal_nan = True)}")
+    print(f"float32 identical to rounded output: {np.array_equal(outputs['FusedTransformer float32'].to_numpy(), expected.astype(np.float32), equal_nan = True)}")
@@ -0,0 +1,94 @@
+# Memory of artifacts loaded by each of several worker processes, unpickled in every worker versus memory mapped
+# from one shared export, and time of single row prediction. Linux only (reads /proc/self/smaps_rollup),
+# run from the repository root: python benchmarks/bench_mmap_workers.py [n_workers]
+import os
+import sys
+import time
+import tempfile
+import multiprocessing as mp
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(ROOT_DIR, "api", "models")
+
+RECORD = {
+    "person_age": 25,
+    "person_income": 50000,
+    "person_home_ownership": "RENT",
+    "person_emp_length": 3.0,
+    "loan_intent": "EDUCATION",
+    "loan_grade": "B",
+    "loan_amnt": 8000,
+    "loan_int_rate": 11.0,
+    "loan_percent_income": 0.16,
+    "cb_person_default_on_file": "N",
+    "cb_person_cred_hist_length": 4
+}
+
+def memory_kb():
+    # Rss counts shared pages fully in every process, Pss splits them between the processes mapping them
+    memory = {}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            fields = line.split()
+            if(fields[0] in ("Rss:", "Pss:")):
+                memory[fields[0][:-1]] = int(fields[1])
+
+    return memory
+
+def worker(mode, mmap_dir, ready, done, results):
+    sys.path.insert(0, os.path.join(ROOT_DIR, "api", "src"))
+    import artifacts
+
+    before = memory_kb()
+
+    reloader = artifacts.ArtifactReloader(
+        artifacts.LocalArtifactBackend(MODELS_DIR),
+        mmap_dir = mmap_dir if mode == "mmap" else None
+    )
+    reloader.reload()
+
+    compiled_preprocessor = reloader.current.compiled_preprocessor
+    compiled_tree = reloader.current.compiled_tree
+    row = compiled_preprocessor.transform_record(RECORD)[0]
+
+    n_calls = 20000
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        compiled_tree.predict_row(row)
+    predict_time = (time.perf_counter() - start) / n_calls
+
+    # Pss is read while every worker is still alive, so shared pages are split between all of them
+    ready.put(None)
+    done.wait()
+
+    after = memory_kb()
+    results.put((after["Rss"] - before["Rss"], after["Pss"] - before["Pss"], predict_time))
+
+def run(mode, n_workers, mmap_dir):
+    context = mp.get_context("spawn")
+    ready, done, results = context.Queue(), context.Event(), context.Queue()
+
+    processes = [context.Process(target = worker, args = (mode, mmap_dir, ready, done, results)) for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+
+    for _ in processes:
+        ready.get()
+    done.set()
+
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    rss = sum(val[0] for val in measured) / n_workers / 1024
+    pss = sum(val[1] for val in measured) / n_workers / 1024
+    predict_time = sum(val[2] for val in measured) / n_workers
+
+    print(f"{mode}: {n_workers} workers, artifacts take {rss:.2f} MiB RSS and {pss:.2f} MiB PSS per worker, predict_row {predict_time * 1e6:.2f} us")
+
+if __name__ == "__main__":
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    with tempfile.TemporaryDirectory() as mmap_dir:
+        run("pickle", n_workers, mmap_dir)
+        run("mmap", n_workers, mmap_dir)
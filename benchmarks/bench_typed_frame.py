@@ -0,0 +1,55 @@
+# Memory and build time of the DataFrame of extracted data_credit rows built by pd.DataFrame of tuples and by
+# extraction_util.rows_to_frame. Needs the packages of the Airflow image (the DAG utils import airflow) and
+# a database holding data_credit, run from the repository root:
+# python benchmarks/bench_typed_frame.py [dsn] [n_rows]
+# e.g. python benchmarks/bench_typed_frame.py "host=localhost user=postgres dbname=postgres" 1000000
+import os
+import sys
+import time
+import psycopg2
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "dags"))
+
+from credit_scoring_service.utils import extraction_util
+
+def fetch_rows(dsn, n_rows):
+    # Rows as the pickle extraction mode pushes them, a list of tuples and the column names
+    connection = psycopg2.connect(dsn)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM data_credit ORDER BY created_at ASC, id ASC LIMIT %s;", (n_rows,))
+        rows = cursor.fetchall()
+        colnames = [desc[0] for desc in cursor.description]
+        cursor.close()
+    finally:
+        connection.close()
+
+    return rows, colnames
+
+def measure(function):
+    start = time.perf_counter()
+    frame = function()
+    elapsed = time.perf_counter() - start
+
+    return frame, elapsed, frame.memory_usage(deep = True).sum() / 1024 ** 2
+
+if __name__ == "__main__":
+    # Empty DSN takes the connection from libpq environment variables, e.g. PGHOST, PGUSER, and PGDATABASE
+    dsn = sys.argv[1] if len(sys.argv) > 1 else ""
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+
+    rows, colnames = fetch_rows(dsn, n_rows)
+    print(f"{len(rows)} rows of {len(colnames)} columns")
+
+    frames = {}
+    for name, function in [
+        ("pd.DataFrame", lambda: pd.DataFrame(rows, columns = colnames)),
+        ("rows_to_frame", lambda: extraction_util.rows_to_frame(rows = rows, colnames = colnames))
+    ]:
+        frames[name], elapsed, memory = measure(function)
+        print(f"{name}: {elapsed:.2f} s, {memory:.1f} MiB")
+
+    print("dtypes of rows_to_frame:")
+    print(frames["rows_to_frame"].dtypes.to_string())
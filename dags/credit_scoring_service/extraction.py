@@ -1,6 +1,8 @@
+import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from airflow.decorators import task
-from credit_scoring_service.utils import utils
+from credit_scoring_service.utils import utils, extraction_util
 
 @task(task_id = "extract_credit_data")
 def extract_credit_data(**kwargs):
@@ -17,98 +19,392 @@ def extract_credit_data(**kwargs):
     )
     print(f"Last extracted credit data: {last_extracted_date}")
 
-    # Connect to database
-    _, cursor = utils.connect_database(db_conn_id = "credit-data-db-conn")
+    # Extraction mode, 'pickle' fetches the whole delta at once, 'stream' writes it chunk by chunk as Parquet parts,
+    # 'partition' splits the date window and streams every sub-range concurrently over its own connection,
+    # 'keyset' pages after the last extracted row and checkpoints every pushed page so retry resumes
+    extraction_mode = utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_mode",
+        default = "pickle"
+    )
+    print(f"Extraction mode: {extraction_mode}")
+
+    # Large objects are serialized straight into multipart upload instead of being buffered whole in memory
+    stream_transfer = utils.variable_do(method = "get", key = "credit_data_stream_transfer", default = "0") == "1"
 
-    # Condition if there is no data in airflow variable for 'last_extracted_date', this is important to query the whole dataset for training
-    if(last_extracted_date == None):
-        print(f"Getting first date of credit data in database.")
+    # Connect to database, the connection is returned to the pool of this process when the task body ends
+    with utils.database_connection(db_conn_id = "credit-data-db-conn") as (connection, cursor):
+        # Condition if there is no data in airflow variable for 'last_extracted_date', this is important to query the whole dataset for training
+        if(last_extracted_date == None):
+            print(f"Getting first date of credit data in database.")
+            cursor.execute("""
+                       SELECT created_at
+                       FROM data_credit
+                       ORDER BY created_at ASC
+                       LIMIT 1;
+                       """)
+            last_extracted_date = cursor.fetchall()[0][0]
+            print(f"First date of credit data in database is {last_extracted_date}")
+
+            # Store the data in airflow variable
+            utils.variable_do(
+                method = "set",
+                key = "last_extracted_credit_data",
+                data = last_extracted_date
+            )
+
+        # Get latest date of credit data in database
         cursor.execute("""
-                   SELECT created_at
-                   FROM data_credit
-                   ORDER BY created_at ASC
-                   LIMIT 1;
-                   """)
-        last_extracted_date = cursor.fetchall()[0][0]
-        print(f"First date of credit data in database is {last_extracted_date}")
-
-        # Store the data in airflow variable
-        utils.variable_do(
-            method = "set",
-            key = "last_extracted_credit_data",
-            data = last_extracted_date
-        )
+                       SELECT created_at
+                       FROM data_credit
+                       ORDER BY created_at DESC
+                       LIMIT 1;
+                       """)
+        latest_credit_data_date = cursor.fetchall()[0][0]
+        print(f"Lastest credit data: {latest_credit_data_date}")
+
+        # Convert from string date to datetime data type
+        last_extracted_date = datetime.strptime(last_extracted_date, "%Y-%m-%d")
+        latest_credit_data_date = datetime.strptime(latest_credit_data_date, "%Y-%m-%d")
+
+        # Condition if last extracted date is less than lastest date in database, meaning there are new data
+        # Keyset mode has exclusive lower bound, so new rows of the last extracted day are found as well
+        if(extraction_mode == "keyset"):
+            extract_keyset(
+                ti = ti,
+                connection = connection,
+                last_extracted_date = last_extracted_date,
+                latest_credit_data_date = latest_credit_data_date
+            )
+
+        elif(last_extracted_date < latest_credit_data_date):
+            print(f"Newer data available, delta time is: {latest_credit_data_date - last_extracted_date}")
 
-    # Get latest date of credit data in database
-    cursor.execute("""
-                   SELECT created_at
-                   FROM data_credit
-                   ORDER BY created_at DESC
-                   LIMIT 1;
-                   """)
-    latest_credit_data_date = cursor.fetchall()[0][0]
-    print(f"Lastest credit data: {latest_credit_data_date}")
-
-    # Convert from string date to datetime data type
-    last_extracted_date = datetime.strptime(last_extracted_date, "%Y-%m-%d")
-    latest_credit_data_date = datetime.strptime(latest_credit_data_date, "%Y-%m-%d")
-
-    # Condition if last extracted date is less than lastest date in database, meaning there are new data
-    if(last_extracted_date < latest_credit_data_date):
-        print(f"Newer data available, delta time is: {latest_credit_data_date - last_extracted_date}")
-
-        # Get data from last extracted to the latest data
-        cursor.execute(f"""
+            # Get data from last extracted to the latest data
+            query = f"""
                     SELECT *
                     FROM data_credit
                     WHERE created_at
                     BETWEEN '{last_extracted_date.strftime("%Y-%m-%d")}'
                     AND '{latest_credit_data_date.strftime("%Y-%m-%d")}'
                     ORDER BY created_at ASC;
-                    """)
-        newest_credit_data = cursor.fetchall()
+                    """
 
-        # Store current date of extracted data to airflow variable so next time it runs it will not query from beginning
-        utils.variable_do(
-            method = "set", 
-            key = "last_extracted_credit_data",
-            data = newest_credit_data[-1][-1]
-        )
+            if(extraction_mode == "stream"):
+                extract_stream(
+                    ti = ti,
+                    connection = connection,
+                    query = query,
+                    latest_credit_data_date = latest_credit_data_date
+                )
 
-        # Pushing query result to MinIO in pickle format (right now only supported pickle format)
-        utils.minio_do(
-            method = "push",
-            key = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}.pkl",
-            bucket_name = "credit-scoring-service",
-            data = newest_credit_data
-        )
+            elif(extraction_mode == "partition"):
+                extract_partitioned(
+                    ti = ti,
+                    last_extracted_date = last_extracted_date,
+                    latest_credit_data_date = latest_credit_data_date
+                )
 
-        # Push the filename of query result to XCOM so next task could used it
-        # Large data isn't recommended to be pushed to XCOM 
-        utils.xcom_do(
-            ti = ti,
-            method = "push",
-            key = "extracted_data_filename",
-            data = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}.pkl"
+            elif(extraction_mode == "pickle"):
+                cursor.execute(query)
+                newest_credit_data = cursor.fetchall()
+
+                # Store current date of extracted data to airflow variable so next time it runs it will not query from beginning
+                utils.variable_do(
+                    method = "set", 
+                    key = "last_extracted_credit_data",
+                    data = newest_credit_data[-1][-1]
+                )
+
+                # Pushing query result to MinIO in pickle format (right now only supported pickle format)
+                utils.minio_do(
+                    method = "push",
+                    key = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}.pkl",
+                    bucket_name = "credit-scoring-service",
+                    data = newest_credit_data,
+                    stream = stream_transfer
+                )
+
+                # Push the filename of query result to XCOM so next task could used it
+                # Large data isn't recommended to be pushed to XCOM 
+                utils.xcom_do(
+                    ti = ti,
+                    method = "push",
+                    key = "extracted_data_filename",
+                    data = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}.pkl"
+                )
+
+                # Pushing query result to MinIO in pickle format (right now only supported pickle format)
+                utils.minio_do(
+                    method = "push",
+                    key = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}_colnames.pkl",
+                    bucket_name = "credit-scoring-service",
+                    data = [desc[0] for desc in cursor.description]
+                )
+
+                # Push the filename of query result to XCOM so next task could used it
+                # Large data isn't recommended to be pushed to XCOM 
+                utils.xcom_do(
+                    ti = ti,
+                    method = "push",
+                    key = "extracted_data_colnames",
+                    data = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}_colnames.pkl"
+                )
+
+            else:
+                raise RuntimeError(f"The variable 'credit_data_extraction_mode' expected 'pickle', 'stream', 'partition', or 'keyset', but {str(extraction_mode)} is given.")
+
+        # Condition when there is no new dat available in database
+        else:
+            print(f"No new data available, delta time is: {latest_credit_data_date - last_extracted_date}")
+
+    stats = utils.client_stats()
+    print(f"Clients created and reused: {stats}")
+
+def get_chunk_size():
+    return int(utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_chunk_size",
+        default = "50000"
+    ))
+
+def get_backend():
+    # 'cursor' fetches rows through server side cursor, 'copy' exports them with COPY ... TO STDOUT as CSV
+    return utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_backend",
+        default = "cursor"
+    )
+
+def extract_stream(ti, connection, query, latest_credit_data_date):
+    # Rows stay in PostgreSQL behind server side cursor and are fetched chunk_size rows at a time,
+    # every chunk is converted to typed columns and pushed as one Parquet part under the same prefix
+    chunk_size = get_chunk_size()
+    backend = get_backend()
+
+    extracted_prefix = f"extraction_{latest_credit_data_date.strftime('%Y%m%d')}/"
+
+    part_keys, n_rows, newest_date = extraction_util.write_parts(
+        tables = extraction_util.query_tables(
+            connection = connection,
+            query = query,
+            chunk_size = chunk_size,
+            backend = backend
+        ),
+        prefix = extracted_prefix,
+        bucket_name = "credit-scoring-service"
+    )
+    print(f"{n_rows} rows has been pushed to MinIO as {len(part_keys)} parts under {extracted_prefix} using {backend} backend")
+
+    # Store current date of extracted data to airflow variable so next time it runs it will not query from beginning
+    utils.variable_do(
+        method = "set",
+        key = "last_extracted_credit_data",
+        data = newest_date
+    )
+
+    # Push the prefix instead of file name, preprocessing reads every part under it
+    utils.xcom_do(
+        ti = ti,
+        method = "push",
+        key = "extracted_data_filename",
+        data = extracted_prefix
+    )
+
+def extract_partitioned(ti, last_extracted_date, latest_credit_data_date):
+    chunk_size = get_chunk_size()
+    backend = get_backend()
+
+    # Number of date sub-ranges and how many of them are extracted at the same time
+    n_partitions = int(utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_partitions",
+        default = "8"
+    ))
+    parallelism = int(utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_parallelism",
+        default = "4"
+    ))
+
+    date_ranges = extraction_util.split_date_range(
+        start_date = last_extracted_date,
+        end_date = latest_credit_data_date,
+        n_partitions = n_partitions
+    )
+    print(f"Extracting {len(date_ranges)} partitions with parallelism {parallelism}.")
+
+    extracted_prefix = f"extraction_{latest_credit_data_date.strftime('%Y%m%d')}/"
+
+    # Sub-ranges don't overlap, together they cover the same rows as BETWEEN of the whole window
+    with ThreadPoolExecutor(max_workers = parallelism) as executor:
+        futures = []
+        for i, (start_date, end_date) in enumerate(date_ranges):
+            query = f"""
+                    SELECT *
+                    FROM data_credit
+                    WHERE created_at >= '{start_date.strftime("%Y-%m-%d")}'
+                    AND created_at < '{end_date.strftime("%Y-%m-%d")}'
+                    ORDER BY created_at ASC;
+                    """
+
+            futures.append(executor.submit(
+                extraction_util.extract_partition,
+                db_conn_id = "credit-data-db-conn",
+                query = query,
+                prefix = f"{extracted_prefix}partition-{i:03d}/",
+                bucket_name = "credit-scoring-service",
+                chunk_size = chunk_size,
+                backend = backend
+            ))
+
+        partitions = [future.result() for future in futures]
+
+    for partition, (start_date, end_date) in zip(partitions, date_ranges):
+        partition["start_date"] = start_date.strftime("%Y-%m-%d")
+        partition["end_date"] = end_date.strftime("%Y-%m-%d")
+        print(f"Partition {partition['prefix']} from {partition['start_date']} until before {partition['end_date']}: {partition['rows']} rows in {len(partition['parts'])} parts")
+
+    # Manifest is pushed last, so downstream task never sees partitions of unfinished extraction
+    newest_date = max(partition["watermark"] for partition in partitions if partition["watermark"] is not None)
+    manifest_key = f"{extracted_prefix}manifest.json"
+    utils.minio_do(
+        method = "push",
+        key = manifest_key,
+        bucket_name = "credit-scoring-service",
+        data = {
+            "rows": sum(partition["rows"] for partition in partitions),
+            "watermark": newest_date,
+            "partitions": partitions
+        }
+    )
+
+    # Store current date of extracted data to airflow variable so next time it runs it will not query from beginning
+    utils.variable_do(
+        method = "set",
+        key = "last_extracted_credit_data",
+        data = newest_date
+    )
+
+    # Push the manifest key, preprocessing reads every part listed in it
+    utils.xcom_do(
+        ti = ti,
+        method = "push",
+        key = "extracted_data_filename",
+        data = manifest_key
+    )
+
+def extract_keyset(ti, connection, last_extracted_date, latest_credit_data_date):
+    chunk_size = get_chunk_size()
+    pk_col = utils.variable_do(
+        method = "get",
+        key = "credit_data_primary_key",
+        default = "id"
+    )
+
+    # Checkpoint of unfinished extraction, retried task continues right after its last pushed part
+    checkpoint = utils.variable_do(
+        method = "get",
+        key = "credit_data_extraction_checkpoint"
+    )
+
+    if(checkpoint != None):
+        checkpoint = json.loads(checkpoint)
+        print(f"Resuming extraction after {checkpoint['lower_bound']}, {len(checkpoint['parts'])} parts has been pushed before.")
+
+    else:
+        # Key of the last extracted row is exclusive lower bound, watermark of other modes only has the date so that day is read again
+        last_extracted_key = utils.variable_do(
+            method = "get",
+            key = "last_extracted_credit_data_key"
         )
 
-        # Pushing query result to MinIO in pickle format (right now only supported pickle format)
+        if(last_extracted_key != None):
+            lower_bound = json.loads(last_extracted_key)
+        else:
+            lower_bound = [last_extracted_date.strftime("%Y-%m-%d"), None]
+
+        checkpoint = {
+            "lower_bound": lower_bound,
+            "upper_bound": latest_credit_data_date.strftime("%Y-%m-%d"),
+            "prefix": f"extraction_{latest_credit_data_date.strftime('%Y%m%d')}/",
+            "parts": [],
+            "rows": 0
+        }
+
+    print(f"Extracting rows after {checkpoint['lower_bound']} until {checkpoint['upper_bound']}.")
+
+    for table, lower_bound in extraction_util.keyset_query(
+        connection = connection,
+        pk_col = pk_col,
+        lower_bound = checkpoint["lower_bound"],
+        upper_bound = checkpoint["upper_bound"],
+        chunk_size = chunk_size
+    ):
+        # Part of the same number is overwritten on retry if it was pushed after the last checkpoint
+        part_key = f"{checkpoint['prefix']}part-{len(checkpoint['parts']):05d}.parquet"
         utils.minio_do(
             method = "push",
-            key = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}_colnames.pkl",
+            key = part_key,
             bucket_name = "credit-scoring-service",
-            data = [desc[0] for desc in cursor.description]
+            data = table
         )
 
-        # Push the filename of query result to XCOM so next task could used it
-        # Large data isn't recommended to be pushed to XCOM 
-        utils.xcom_do(
-            ti = ti,
-            method = "push",
-            key = "extracted_data_colnames",
-            data = f"extraction_{newest_credit_data[-1][-1].replace("-", "")}_colnames.pkl"
+        checkpoint["lower_bound"] = lower_bound
+        checkpoint["parts"].append(part_key)
+        checkpoint["rows"] += table.num_rows
+
+        utils.variable_do(
+            method = "set",
+            key = "credit_data_extraction_checkpoint",
+            data = json.dumps(checkpoint, default = str)
         )
-    
-    # Condition when there is no new dat available in database
-    else:
-        print(f"No new data available, delta time is: {latest_credit_data_date - last_extracted_date}")
\ No newline at end of file
+        print(f"Checkpoint after {lower_bound}, {checkpoint['rows']} rows has been pushed.")
+
+    if(len(checkpoint["parts"]) == 0):
+        print(f"No new data available after {checkpoint['lower_bound']}.")
+
+        utils.variable_do(method = "delete", key = "credit_data_extraction_checkpoint")
+        return
+
+    newest_date, newest_key = checkpoint["lower_bound"]
+
+    manifest_key = f"{checkpoint['prefix']}manifest.json"
+    utils.minio_do(
+        method = "push",
+        key = manifest_key,
+        bucket_name = "credit-scoring-service",
+        data = {
+            "rows": checkpoint["rows"],
+            "watermark": newest_date,
+            "partitions": [{
+                "prefix": checkpoint["prefix"],
+                "parts": checkpoint["parts"],
+                "rows": checkpoint["rows"],
+                "watermark": newest_date
+            }]
+        }
+    )
+
+    # Store current date and key of extracted data to airflow variable so next time it starts right after the last row
+    utils.variable_do(
+        method = "set",
+        key = "last_extracted_credit_data",
+        data = newest_date
+    )
+    utils.variable_do(
+        method = "set",
+        key = "last_extracted_credit_data_key",
+        data = json.dumps([newest_date, newest_key], default = str)
+    )
+
+    # Push the manifest key, preprocessing reads every part listed in it
+    utils.xcom_do(
+        ti = ti,
+        method = "push",
+        key = "extracted_data_filename",
+        data = manifest_key
+    )
+
+    # Extraction is complete, next run starts a new checkpoint
+    utils.variable_do(method = "delete", key = "credit_data_extraction_checkpoint")
\ No newline at end of file
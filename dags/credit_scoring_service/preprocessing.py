@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 from airflow.decorators import task
-from credit_scoring_service.utils import utils, preprocess_util
+from credit_scoring_service.utils import utils, preprocess_util, extraction_util, feature_store
 
 @task(task_id = "preprocess_credit_data")
 def preprocess_credit_data(**kwargs):
@@ -8,6 +9,9 @@ def preprocess_credit_data(**kwargs):
 
     print("Pulling data and data's column names from MinIO.")
 
+    # Large objects are transferred through multipart upload and response stream instead of being buffered whole in memory
+    stream_transfer = utils.variable_do(method = "get", key = "credit_data_stream_transfer", default = "0") == "1"
+
     # Get the file name of data previously pushed to MinIO so this task could pull the data from MinIO
     extracted_data_filename = utils.xcom_do(
         ti = ti,
@@ -17,184 +21,274 @@ def preprocess_credit_data(**kwargs):
         include_prior_dates = True
     )
 
-    # Also get the file containing list of column names
-    extracted_data_colnames = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        task_ids = "extract_credit_data",
-        key = "extracted_data_colnames",
-        include_prior_dates = True
-    )
+    # Streaming extraction pushes prefix of Parquet parts, the parts already carry column names and types
+    if(extracted_data_filename.endswith("/")):
+        dataset = extraction_util.read_parts(
+            prefix = extracted_data_filename,
+            bucket_name = "credit-scoring-service"
+        )
 
-    # Pulling the new data from MinIO
-    new_extracted_data = utils.minio_do(
-        method = "pull",
-        key = extracted_data_filename,
-        bucket_name = "credit-scoring-service"
-    )
-    
-    # Pulling the list of column name from MinIO
-    new_extracted_data_colnames = utils.minio_do(
-        method = "pull",
-        key = extracted_data_colnames,
-        bucket_name = "credit-scoring-service"
-    )
+        print("Start preprocessing data.")
+
+    # Partitioned extraction pushes manifest listing parts of every partition
+    elif(extracted_data_filename.endswith(".json")):
+        dataset = extraction_util.read_manifest(
+            key = extracted_data_filename,
+            bucket_name = "credit-scoring-service"
+        )
+
+        print("Start preprocessing data.")
 
-    print("Start preprocessing data.")
+    else:
+        # Also get the file containing list of column names
+        extracted_data_colnames = utils.xcom_do(
+            ti = ti,
+            method = "pull",
+            task_ids = "extract_credit_data",
+            key = "extracted_data_colnames",
+            include_prior_dates = True
+        )
 
-    # Create DataFrame of those 2 parts in order to be preprocessed further
-    dataset = pd.DataFrame(new_extracted_data, columns = new_extracted_data_colnames)
+        # Pulling the new data from MinIO
+        new_extracted_data = utils.minio_do(
+            method = "pull",
+            key = extracted_data_filename,
+            bucket_name = "credit-scoring-service",
+            stream = stream_transfer
+        )
+        
+        # Pulling the list of column name from MinIO
+        new_extracted_data_colnames = utils.minio_do(
+            method = "pull",
+            key = extracted_data_colnames,
+            bucket_name = "credit-scoring-service"
+        )
+
+        print("Start preprocessing data.")
+
+        # Create DataFrame of those 2 parts in order to be preprocessed further, typed loader builds it column by column
+        # with category for categorical columns and 32 bit numbers for numerical columns of data_credit
+        if(utils.variable_do(method = "get", key = "credit_data_typed_frame", default = "0") == "1"):
+            dataset = extraction_util.rows_to_frame(rows = new_extracted_data, colnames = new_extracted_data_colnames)
+        else:
+            dataset = pd.DataFrame(new_extracted_data, columns = new_extracted_data_colnames)
+
+        print(f"Dataset of {len(dataset)} rows takes {dataset.memory_usage(deep = True).sum() / 1024 ** 2:.1f} MiB in memory.")
+
+    # Training window, 'delta' uses only the rows of this extraction, 'all' every stored date, or number of the latest dates
+    training_window = utils.variable_do(method = "get", key = "credit_data_training_window", default = "delta")
+    if(training_window != "delta" and training_window != "all" and not (training_window.isdigit() and int(training_window) > 0)):
+        raise RuntimeError(f"The variable 'credit_data_training_window' expected 'delta', 'all', or positive number of days, but {str(training_window)} is given.")
+
+    # New rows are appended to the feature store only when the training window reads it, or when 'credit_data_feature_store'
+    # is set to build the history before switching the window, dates written more than once are compacted into one part
+    primary_key = utils.variable_do(method = "get", key = "credit_data_primary_key", default = "id")
+    if(training_window != "delta" or utils.variable_do(method = "get", key = "credit_data_feature_store", default = "0") == "1"):
+        appended_dates = feature_store.append(dataset = dataset, bucket_name = "credit-scoring-service")
+        feature_store.compact(bucket_name = "credit-scoring-service", primary_key = primary_key, dates = appended_dates)
+
+    if(training_window != "delta"):
+        dataset = feature_store.read_window(
+            bucket_name = "credit-scoring-service",
+            end_date = utils.variable_do(method = "get", key = "last_extracted_credit_data"),
+            window_days = None if training_window == "all" else int(training_window),
+            primary_key = primary_key
+        )
     
     # Split columnwise dataset into features (input) and target (output)
     X, y = preprocess_util.split_input_output(data = dataset, target_col = "loan_status")
 
-    # Split rowwise dataset into train, valid, and test set
-    X_train, X_not_train, y_train, y_not_train = preprocess_util.split_train_test(
-        X = X,
-        y = y,
-        test_size = 0.2,
-        random_state = 42
-    )
-    X_valid, X_test, y_valid, y_test = preprocess_util.split_train_test(
-        X = X_not_train,
-        y = y_not_train,
-        test_size = 0.5,
-        random_state = 42
-    )
+    # 'copies' splits the dataset into train, valid, and test set DataFrames, 'index' only keeps stratified positions
+    # of their rows and transforms the whole dataset once into one matrix where every set is a contiguous slice
+    split_mode = utils.variable_do(method = "get", key = "credit_data_split_mode", default = "copies")
+
+    if(split_mode == "index"):
+        split = preprocess_util.split_train_test_index(
+            y = y,
+            test_size = 0.2,
+            holdout_test_size = 0.5,
+            random_state = 42
+        )
+
+        # Imputers, encoder, and scaler are still fitted on the train rows only
+        X_train = X.iloc[split["index"][split["train"][0]:split["train"][1]]]
+
+    elif(split_mode == "copies"):
+        # Split rowwise dataset into train, valid, and test set
+        X_train, X_not_train, y_train, y_not_train = preprocess_util.split_train_test(
+            X = X,
+            y = y,
+            test_size = 0.2,
+            random_state = 42
+        )
+        X_valid, X_test, y_valid, y_test = preprocess_util.split_train_test(
+            X = X_not_train,
+            y = y_not_train,
+            test_size = 0.5,
+            random_state = 42
+        )
+
+    else:
+        raise RuntimeError(f"The variable 'credit_data_split_mode' expected 'copies' or 'index', but {str(split_mode)} is given.")
+
+    # Sparse mode keeps OHE block in CSR form next to the numerical and label encoded blocks,
+    # the scaler is fitted without centering so inactive OHE columns stay zero
+    sparse_mode = utils.variable_do(method = "get", key = "credit_data_sparse", default = "0") == "1"
 
     # Fit inputer, encoder, andscaler
-    num_imputer, cat_imputer, ohe_encoder, scaler = preprocess_util.fit_preprocess_data(X_train)
+    # Chunked fit only holds transformed copies of one chunk of the train set instead of the whole train set
+    fit_chunk_size = int(utils.variable_do(method = "get", key = "credit_data_fit_chunk_size", default = "0"))
+    if(fit_chunk_size > 0):
+        num_imputer, cat_imputer, ohe_encoder, scaler = preprocess_util.fit_preprocess_data_chunked(
+            lambda: preprocess_util.iter_chunks(X = X_train, chunk_size = fit_chunk_size),
+            sparse = sparse_mode
+        )
+    else:
+        num_imputer, cat_imputer, ohe_encoder, scaler = preprocess_util.fit_preprocess_data(X_train, sparse = sparse_mode)
 
-    # Retransform the train set data
-    X_train_clean = preprocess_util.transform_preprocess_data(
-        X = X_train,
-        num_imputer = num_imputer,
-        cat_imputer = cat_imputer,
-        ohe_encoder = ohe_encoder,
-        scaler = scaler
-    )
+    # 'fused' writes imputed, encoded, and scaled values of every set straight into one preallocated matrix,
+    # 'pandas' transforms step by step with a DataFrame for every step
+    transform_mode = utils.variable_do(method = "get", key = "credit_data_transform_mode", default = "pandas")
+    transform_dtype = utils.variable_do(method = "get", key = "credit_data_transform_dtype", default = "float64")
 
-    # Transform the valid set data
-    X_valid_clean = preprocess_util.transform_preprocess_data(
-        X = X_valid,
-        num_imputer = num_imputer,
-        cat_imputer = cat_imputer,
-        ohe_encoder = ohe_encoder,
-        scaler = scaler
-    )
+    if(sparse_mode and transform_mode != "fused"):
+        raise RuntimeError(f"The variable 'credit_data_transform_mode' expected 'fused' in sparse mode, but {str(transform_mode)} is given.")
 
-    # Transform the test set data
-    X_test_clean = preprocess_util.transform_preprocess_data(
-        X = X_test,
-        num_imputer = num_imputer,
-        cat_imputer = cat_imputer,
-        ohe_encoder = ohe_encoder,
-        scaler = scaler
-    )
+    if(transform_mode == "fused"):
+        if(transform_dtype not in ["float32", "float64"]):
+            raise RuntimeError(f"The variable 'credit_data_transform_dtype' expected 'float32' or 'float64', but {str(transform_dtype)} is given.")
+
+        # Decision tree casts its input to float32 anyway, so float32 sets train the same model with half the memory
+        transformer = preprocess_util.fuse_preprocess_data(
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler,
+            dtype = np.dtype(transform_dtype)
+        )
+
+        # CSR matrices have no column names, the names stay in the scaler
+        transform = transformer.transform_sparse if sparse_mode else transformer.transform_frame
+
+        if(split_mode == "index"):
+            X_clean = transform(X, rows = split["index"])
+
+        else:
+            X_train_clean = transform(X_train)
+            X_valid_clean = transform(X_valid)
+            X_test_clean = transform(X_test)
+
+    elif(transform_mode == "pandas" and split_mode == "index"):
+        X_clean = preprocess_util.transform_preprocess_data(
+            X = X.iloc[split["index"]],
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+
+    elif(transform_mode == "pandas"):
+        # Retransform the train set data
+        X_train_clean = preprocess_util.transform_preprocess_data(
+            X = X_train,
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+
+        # Transform the valid set data
+        X_valid_clean = preprocess_util.transform_preprocess_data(
+            X = X_valid,
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+
+        # Transform the test set data
+        X_test_clean = preprocess_util.transform_preprocess_data(
+            X = X_test,
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+
+    else:
+        raise RuntimeError(f"The variable 'credit_data_transform_mode' expected 'fused' or 'pandas', but {str(transform_mode)} is given.")
 
     print("Preprocessing data completed.")
 
     # Get the date of data extracted
     last_extracted_credit_data = utils.variable_do(method = "get", key = "last_extracted_credit_data").replace("-", "")
 
-    print("Pushing to MinIO.")
+    # File extension of train, valid, and test set decides their format, e.g. 'pkl', 'parquet', 'arrow', or compressed 'pkl.zst'
+    dataset_extension = utils.variable_do(method = "get", key = "credit_data_dataset_format", default = "pkl")
+    if(dataset_extension not in [f"{object_type}{compression}" for object_type in ["pkl", "parquet", "arrow"] for compression in ["", ".zst", ".lz4"]]):
+        raise RuntimeError(f"The variable 'credit_data_dataset_format' expected 'pkl', 'parquet', or 'arrow' optionally followed by '.zst' or '.lz4', but {str(dataset_extension)} is given.")
 
-    # Push train set
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_trainset_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = [X_train_clean, y_train]
-    )
-    utils.xcom_do(
-        ti = ti,
-        method = "push",
-        key = "preprocessed_trainset_filename",
-        data = f"preprocess_trainset_{last_extracted_credit_data}.pkl"
-    )
+    # Columnar formats only hold DataFrame, sparse matrices are pickled
+    if(sparse_mode and not dataset_extension.startswith("pkl")):
+        raise RuntimeError(f"The variable 'credit_data_dataset_format' expected 'pkl' in sparse mode, but {str(dataset_extension)} is given.")
 
-    # Push valid set
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_validset_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = [X_valid_clean, y_valid]
-    )
-    utils.xcom_do(
-        ti = ti,
-        method = "push",
-        key = "preprocessed_validset_filename",
-        data = f"preprocess_validset_{last_extracted_credit_data}.pkl"
+    # Column lists, label encoding maps, imputers, encoder, and scaler are bundled into one artifact with hash of its content
+    feature_pipeline = preprocess_util.FeaturePipeline(
+        num_imputer = num_imputer,
+        cat_imputer = cat_imputer,
+        ohe_encoder = ohe_encoder,
+        scaler = scaler
     )
 
-    # Push test set
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_testset_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = [X_test_clean, y_test]
-    )
-    utils.xcom_do(
-        ti = ti,
-        method = "push",
-        key = "preprocessed_testset_filename",
-        data = f"preprocess_testset_{last_extracted_credit_data}.pkl"
-    )
+    print("Pushing to MinIO.")
 
-    # Push numerical imputer
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_num_imputer_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = num_imputer
-    )
-    utils.xcom_do(
-        ti = ti,
-        method = "push",
-        key = "preprocessed_num_imputer_filename",
-        data = f"preprocess_num_imputer_{last_extracted_credit_data}.pkl"
-    )
+    # Keys of the pushed objects by their role, training looks them up by role from XCom 'preprocessed_filenames'
+    preprocessed_filenames = {"feature_pipeline": f"feature_pipeline_{last_extracted_credit_data}.pkl"}
 
-    # Push categorical imputer
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_cat_imputer_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = cat_imputer
-    )
-    utils.xcom_do(
-        ti = ti,
-        method = "push",
-        key = "preprocessed_cat_imputer_filename",
-        data = f"preprocess_cat_imputer_{last_extracted_credit_data}.pkl"
-    )
+    # Index split mode pushes the cleaned matrix ordered train, valid, then test, and the positions of its rows
+    # in the dataset with the boundaries of every set, training slices the sets out of the matrix
+    if(split_mode == "index"):
+        preprocessed_filenames["dataset"] = f"preprocess_dataset_{last_extracted_credit_data}.{dataset_extension}"
+        preprocessed_filenames["split"] = f"preprocess_split_{last_extracted_credit_data}.pkl"
+        objects = {
+            preprocessed_filenames["dataset"]: utils.pack_dataset(X = X_clean, y = y.iloc[split["index"]], key = preprocessed_filenames["dataset"]),
+            preprocessed_filenames["split"]: split
+        }
+
+    # Train, valid, and test set are pushed at the same time as the feature pipeline
+    else:
+        preprocessed_filenames["train"] = f"preprocess_trainset_{last_extracted_credit_data}.{dataset_extension}"
+        preprocessed_filenames["valid"] = f"preprocess_validset_{last_extracted_credit_data}.{dataset_extension}"
+        preprocessed_filenames["test"] = f"preprocess_testset_{last_extracted_credit_data}.{dataset_extension}"
+        objects = {
+            preprocessed_filenames["train"]: utils.pack_dataset(X = X_train_clean, y = y_train, key = preprocessed_filenames["train"]),
+            preprocessed_filenames["valid"]: utils.pack_dataset(X = X_valid_clean, y = y_valid, key = preprocessed_filenames["valid"]),
+            preprocessed_filenames["test"]: utils.pack_dataset(X = X_test_clean, y = y_test, key = preprocessed_filenames["test"])
+        }
+
+    objects[preprocessed_filenames["feature_pipeline"]] = feature_pipeline.to_bundle()
 
-    # Push one hot encoder
-    utils.minio_do(
+    utils.minio_batch_do(
         method = "push",
-        key = f"preprocess_ohe_{last_extracted_credit_data}.pkl",
         bucket_name = "credit-scoring-service",
-        data = ohe_encoder
+        objects = objects,
+        stream = stream_transfer
     )
+
+    # Keys are only published after every object has been pushed
     utils.xcom_do(
         ti = ti,
         method = "push",
-        key = "preprocessed_ohe_filename",
-        data = f"preprocess_ohe_{last_extracted_credit_data}.pkl"
-    )
-    
-    # Push scaler
-    utils.minio_do(
-        method = "push",
-        key = f"preprocess_scaler_{last_extracted_credit_data}.pkl",
-        bucket_name = "credit-scoring-service",
-        data = scaler
+        key = "preprocessed_filenames",
+        data = preprocessed_filenames
     )
+
+    # Training records the hash in the model without pulling the bundle
     utils.xcom_do(
         ti = ti,
         method = "push",
-        key = "preprocessed_scaler_filename",
-        data = f"preprocess_scaler_{last_extracted_credit_data}.pkl"
+        key = "feature_pipeline_hash",
+        data = feature_pipeline.hash
     )
 
-    print("Trainset, validset, testset, numerical imputer, categorical imputer, ohe, and scaler has been pushed to MinIO.")
\ No newline at end of file
+    print(f"{', '.join(objects)} has been pushed to MinIO.")
\ No newline at end of file
@@ -1,3 +1,4 @@
+import scipy.sparse as sp
 from airflow.decorators import task
 from credit_scoring_service.utils import utils
 from sklearn.tree import DecisionTreeClassifier
@@ -7,117 +8,75 @@ from sklearn.metrics import classification_report
 def training_credit_data(**kwargs):
     ti = kwargs["ti"]
 
-    print("Pulling dataset, encoder, imputer, and scaler from MinIO.")
+    print("Pulling dataset from MinIO.")
 
-    # Pull train set
-    trainset = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_trainset_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    trainset = utils.minio_do(
-        method = "pull",
-        key = trainset,
-        bucket_name = "credit-scoring-service"
-    )
-    
-    # Pull valid set
-    validset = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_validset_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    validset = utils.minio_do(
-        method = "pull",
-        key = validset,
-        bucket_name = "credit-scoring-service"
-    )
+    # Datasets are deserialized straight from response stream instead of being buffered whole in memory
+    stream_transfer = utils.variable_do(method = "get", key = "credit_data_stream_transfer", default = "0") == "1"
 
-    # Pull test set
-    testset = utils.xcom_do(
+    # Keys of the objects pushed by preprocessing by their role: 'train', 'valid', and 'test' set, or 'dataset' and 'split'
+    # in index split mode, and 'feature_pipeline'
+    preprocessed_filenames = utils.xcom_do(
         ti = ti,
         method = "pull",
-        key = "preprocessed_testset_filename",
         task_ids = "preprocess_credit_data",
+        key = "preprocessed_filenames",
         include_prior_dates = True
     )
-    testset = utils.minio_do(
-        method = "pull",
-        key = testset,
-        bucket_name = "credit-scoring-service"
-    )
 
-    # Pull numerical imputer
-    num_imputer = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_num_imputer_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    num_imputer = utils.minio_do(
-        method = "pull",
-        key = num_imputer,
-        bucket_name = "credit-scoring-service"
-    )
+    if(not isinstance(preprocessed_filenames, dict)):
+        raise RuntimeError(f"The XCom 'preprocessed_filenames' expected mapping of role to key, but {str(preprocessed_filenames)} is given.")
 
-    # Pull categorical imputer
-    cat_imputer = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_cat_imputer_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    cat_imputer = utils.minio_do(
-        method = "pull",
-        key = cat_imputer,
-        bucket_name = "credit-scoring-service"
-    )
+    # Index split mode pushes one cleaned matrix and the positions of its sets, every set is a slice of the matrix
+    if("split" in preprocessed_filenames):
+        datasets = utils.minio_batch_do(
+            method = "pull",
+            bucket_name = "credit-scoring-service",
+            keys = [preprocessed_filenames["dataset"], preprocessed_filenames["split"]],
+            stream = stream_transfer
+        )
 
-    # Pull one hot encoder
-    ohe_encoder = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_ohe_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    ohe_encoder = utils.minio_do(
-        method = "pull",
-        key = ohe_encoder,
-        bucket_name = "credit-scoring-service"
-    )
-    
-    # Pull scaler
-    scaler = utils.xcom_do(
-        ti = ti,
-        method = "pull",
-        key = "preprocessed_scaler_filename",
-        task_ids = "preprocess_credit_data",
-        include_prior_dates = True
-    )
-    scaler = utils.minio_do(
-        method = "pull",
-        key = scaler,
-        bucket_name = "credit-scoring-service"
-    )
+        trainset, validset, testset = utils.slice_dataset(
+            dataset = utils.unpack_dataset(datasets[preprocessed_filenames["dataset"]]),
+            split = datasets[preprocessed_filenames["split"]]
+        )
+
+    # Train, valid, and test set are pulled at the same time, training never uses the feature pipeline itself
+    else:
+        datasets = utils.minio_batch_do(
+            method = "pull",
+            bucket_name = "credit-scoring-service",
+            keys = [preprocessed_filenames[role] for role in ["train", "valid", "test"]],
+            stream = stream_transfer
+        )
+
+        trainset, validset, testset = [utils.unpack_dataset(datasets[preprocessed_filenames[role]]) for role in ["train", "valid", "test"]]
 
     print("Start training model.")
 
-    # Training model
+    # Training model, decision tree accepts sparse train set of sparse mode directly
     model = DecisionTreeClassifier()
     model.fit(trainset[0], trainset[1])
 
+    # Record whether the model is fitted on sparse matrix, so the API predicts it on sparse batches as well
+    model.sparse_input_ = sp.issparse(trainset[0])
+
     print("Training model completed.")
 
     # Get the date of data extracted
     last_extracted_credit_data = utils.variable_do(method = "get", key = "last_extracted_credit_data").replace("-", "")
 
+    # Record version of preprocessing artifacts used by this model, so the API loads matching preprocessing artifacts
+    model.preprocess_version_ = last_extracted_credit_data
+
+    # Record hash of the feature pipeline fitted with the train set, the API refuses to serve the model with other pipeline
+    model.feature_pipeline_hash_ = utils.xcom_do(
+        ti = ti,
+        method = "pull",
+        task_ids = "preprocess_credit_data",
+        key = "feature_pipeline_hash",
+        include_prior_dates = True
+    )
+
     print("Pushing to MinIO for model versioning.")
 
     # Push trained model to MinIO for versioning
@@ -0,0 +1,133 @@
+import os
+import json
+import fcntl
+import uuid
+import hashlib
+from contextlib import contextmanager
+
+# Local cache of MinIO objects, enabled on a worker by setting ARTIFACT_CACHE_DIR
+CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR")
+CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+STATS_NAMES = ["hits", "misses", "writes", "evictions", "bytes_saved", "bytes_downloaded"]
+
+class ArtifactCache:
+    # Objects are stored under the hash of bucket, key, and ETag, so rewritten object never hits older content.
+    # Least recently used files are evicted when the cache grows over max_bytes. Several tasks on the same
+    # worker could share the directory, index and stats changes are serialized by a file lock.
+    def __init__(self, directory, max_bytes = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.objects_dir = os.path.join(directory, "objects")
+        self.tmp_dir = os.path.join(directory, "tmp")
+        self.stats_path = os.path.join(directory, "stats.json")
+        self.lock_path = os.path.join(directory, ".lock")
+
+        os.makedirs(self.objects_dir, exist_ok = True)
+        os.makedirs(self.tmp_dir, exist_ok = True)
+
+    @contextmanager
+    def locked(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path(self, bucket_name, key, etag):
+        digest = hashlib.sha256(f"{bucket_name}/{key}/{etag}".encode()).hexdigest()
+        return os.path.join(self.objects_dir, digest)
+
+    def temp_path(self):
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def lookup(self, bucket_name, key, etag):
+        # Cached file is opened under the lock, the open file stays readable even if other task evicts it later
+        path = self.path(bucket_name, key, etag)
+
+        with self.locked():
+            if(not os.path.exists(path)):
+                return None
+
+            # Modification time is the last use, evictions start from the oldest
+            os.utime(path)
+            self.count(hits = 1, bytes_saved = os.path.getsize(path))
+
+            return open(path, "rb")
+
+    def add(self, bucket_name, key, etag, tmp_path, downloaded = False):
+        path = self.path(bucket_name, key, etag)
+        size = os.path.getsize(tmp_path)
+
+        with self.locked():
+            os.replace(tmp_path, path)
+
+            if(downloaded):
+                self.count(misses = 1, bytes_downloaded = size)
+            else:
+                self.count(writes = 1)
+
+            self.evict(keep = path)
+
+        return path
+
+    def evict(self, keep = None):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.objects_dir):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.path, stat.st_size))
+            total_size += stat.st_size
+
+        # Newest object is kept even if it alone is bigger than the cache
+        n_evictions = 0
+        for _, path, size in sorted(entries):
+            if(total_size <= self.max_bytes):
+                break
+
+            if(path != keep):
+                os.remove(path)
+                total_size -= size
+                n_evictions += 1
+
+        if(n_evictions > 0):
+            self.count(evictions = n_evictions)
+
+    def read_stats(self):
+        if(not os.path.exists(self.stats_path)):
+            return {name: 0 for name in STATS_NAMES}
+
+        with open(self.stats_path) as f:
+            return json.load(f)
+
+    def count(self, **increments):
+        # Called with the lock held
+        stats = self.read_stats()
+        for name, value in increments.items():
+            stats[name] = stats.get(name, 0) + value
+
+        tmp_path = self.temp_path()
+        with open(tmp_path, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, self.stats_path)
+
+    def stats(self):
+        with self.locked():
+            stats = self.read_stats()
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0.0
+
+        return stats
+
+cache = None
+
+def get_cache():
+    # Created once per process, None when the cache isn't configured
+    global cache
+    if(cache is None and CACHE_DIR):
+        cache = ArtifactCache(directory = CACHE_DIR, max_bytes = CACHE_MAX_BYTES)
+
+    return cache
@@ -0,0 +1,138 @@
+import os
+import atexit
+import threading
+from contextlib import contextmanager
+from psycopg2 import extensions
+from airflow.providers.amazon.aws.hooks.s3 import S3Hook
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+
+# At most this many connections of one connection id are open at the same time, further checkouts wait for a return
+POSTGRES_MAX_CONNECTIONS = int(os.getenv("POSTGRES_POOL_MAX_CONNECTIONS", "8"))
+
+class ConnectionPool:
+    # Connections are created only when no idle connection is left, returned connections are kept open
+    def __init__(self, postgres_conn_id, max_connections = POSTGRES_MAX_CONNECTIONS):
+        self.postgres_conn_id = postgres_conn_id
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.idle = []
+
+        self.created = 0
+        self.reused = 0
+
+    def checkout(self):
+        with self.lock:
+            while(len(self.idle) > 0):
+                connection = self.idle.pop()
+
+                # Connection dropped by the server while it was idle is discarded
+                if(connection.closed == 0):
+                    self.reused += 1
+                    return connection
+
+            self.created += 1
+
+        # PostgresHook keeps its last connection in 'conn', so a hook shared by concurrent checkouts could hand
+        # the same connection to two threads. Each new connection is created by its own hook outside the lock.
+        return PostgresHook(postgres_conn_id = self.postgres_conn_id).get_conn()
+
+    def checkin(self, connection):
+        if(connection.closed != 0):
+            return
+
+        status = connection.info.transaction_status
+        if(status == extensions.TRANSACTION_STATUS_UNKNOWN):
+            connection.close()
+            return
+
+        # Uncommitted or failed transaction isn't carried over to the next user
+        if(status != extensions.TRANSACTION_STATUS_IDLE):
+            connection.rollback()
+
+        with self.lock:
+            self.idle.append(connection)
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            connection = self.checkout()
+            try:
+                yield connection
+            finally:
+                self.checkin(connection)
+        finally:
+            self.slots.release()
+
+    def close_all(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle = []
+
+class ClientRegistry:
+    # One S3Hook and one connection pool per connection id for the whole process, hooks look up
+    # the Airflow connection and build boto session and HTTP pool only once instead of on every call
+    def __init__(self, max_connections = POSTGRES_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.lock = threading.Lock()
+
+        self.s3_hooks = {}
+        self.postgres_pools = {}
+
+        self.s3_created = 0
+        self.s3_reused = 0
+
+    def s3_hook(self, aws_conn_id):
+        with self.lock:
+            hook = self.s3_hooks.get(aws_conn_id)
+            if(hook is not None):
+                self.s3_reused += 1
+                return hook
+
+            # Client is created now, so threads sharing the hook share one boto3 client which is thread safe
+            hook = S3Hook(aws_conn_id = aws_conn_id)
+            hook.get_conn()
+
+            self.s3_hooks[aws_conn_id] = hook
+            self.s3_created += 1
+
+        return hook
+
+    def postgres_pool(self, postgres_conn_id):
+        with self.lock:
+            pool = self.postgres_pools.get(postgres_conn_id)
+            if(pool is None):
+                pool = ConnectionPool(
+                    postgres_conn_id = postgres_conn_id,
+                    max_connections = self.max_connections
+                )
+                self.postgres_pools[postgres_conn_id] = pool
+
+        return pool
+
+    @contextmanager
+    def postgres_connection(self, postgres_conn_id):
+        with self.postgres_pool(postgres_conn_id).connection() as connection:
+            yield connection
+
+    def stats(self):
+        with self.lock:
+            pools = list(self.postgres_pools.values())
+
+            return {
+                "s3_clients_created": self.s3_created,
+                "s3_clients_reused": self.s3_reused,
+                "postgres_connections_created": sum(pool.created for pool in pools),
+                "postgres_connections_reused": sum(pool.reused for pool in pools)
+            }
+
+    def close_all(self):
+        with self.lock:
+            pools = list(self.postgres_pools.values())
+
+        for pool in pools:
+            pool.close_all()
+
+registry = ClientRegistry()
+atexit.register(registry.close_all)
@@ -0,0 +1,344 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from psycopg2 import sql
+from datetime import timedelta
+from credit_scoring_service.utils import utils
+
+# Arrow type of each PostgreSQL type OID (pg_type), columns of other types are stored as string
+PG_TYPE_TO_ARROW = {
+    16: pa.bool_(),
+    18: pa.string(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    25: pa.string(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1042: pa.string(),
+    1043: pa.string(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz = "UTC"),
+    1700: pa.float64()
+}
+
+def arrow_schema(description):
+    return pa.schema([pa.field(desc[0], PG_TYPE_TO_ARROW.get(desc[1], pa.string())) for desc in description])
+
+def rows_to_table(rows, schema):
+    # Column by column, so only one column of Python objects exists next to the fetched rows
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [row[i] for row in rows]
+
+        # NUMERIC is fetched as Decimal and unknown types as their own Python objects
+        if(pa.types.is_floating(field.type)):
+            values = [None if val is None else float(val) for val in values]
+        elif(pa.types.is_string(field.type)):
+            values = [None if val is None else str(val) for val in values]
+
+        arrays.append(pa.array(values, type = field.type))
+
+    return pa.Table.from_arrays(arrays, schema = schema)
+
+# dtype of every column of data_credit in DataFrame built by rows_to_frame, columns not listed are kept as Python objects
+CREDIT_DATA_SCHEMA = {
+    "id": "int32",
+    "person_age": "int32",
+    "person_income": "int32",
+    "person_home_ownership": "category",
+    "person_emp_length": "float32",
+    "loan_intent": "category",
+    "loan_grade": "category",
+    "loan_amnt": "int32",
+    "loan_int_rate": "float32",
+    "loan_status": "int32",
+    "loan_percent_income": "float32",
+    "cb_person_default_on_file": "category",
+    "cb_person_cred_hist_length": "int32"
+}
+
+def numeric_column(rows, i, dtype):
+    # Values are converted one by one straight into the array, NULL becomes NaN in float column.
+    # Integer column holding NULL is read again as float32, so NULL is NaN there as well.
+    try:
+        return np.fromiter((row[i] for row in rows), dtype = dtype, count = len(rows))
+    except TypeError:
+        return np.fromiter((row[i] for row in rows), dtype = np.float32, count = len(rows))
+
+def categorical_column(rows, i):
+    # Codes are assigned while reading, only the distinct values exist as Python objects next to the rows
+    categories = {}
+    codes = np.fromiter(
+        (-1 if row[i] is None else categories.setdefault(row[i], len(categories)) for row in rows),
+        dtype = np.int32,
+        count = len(rows)
+    )
+
+    return pd.Categorical.from_codes(codes, categories = list(categories))
+
+def rows_to_frame(rows, colnames, schema = CREDIT_DATA_SCHEMA):
+    # Column by column with the dtype of the schema instead of pd.DataFrame of tuples,
+    # which keeps every string and NUMERIC value as Python object and every other number as 64 bit
+    columns = {}
+    for i, col in enumerate(colnames):
+        dtype = schema.get(col)
+
+        if(dtype == "category"):
+            columns[col] = categorical_column(rows, i)
+        elif(dtype is not None):
+            columns[col] = numeric_column(rows, i, dtype)
+        else:
+            columns[col] = [row[i] for row in rows]
+
+    return pd.DataFrame(columns, columns = colnames, copy = False)
+
+def stream_query(connection, query, chunk_size, cursor_name = "extract_credit_data"):
+    # Named cursor is server side, PostgreSQL keeps the result and sends chunk_size rows per fetchmany
+    cursor = connection.cursor(name = cursor_name)
+    cursor.itersize = chunk_size
+
+    try:
+        cursor.execute(query)
+
+        schema = None
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if(len(rows) == 0):
+                break
+
+            # Description of named cursor is only available after the first fetch
+            if(schema is None):
+                schema = arrow_schema(cursor.description)
+
+            yield rows_to_table(rows, schema)
+
+    finally:
+        cursor.close()
+
+def schema_of_query(connection, query):
+    # Column names and types of the result without fetching any row
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT * FROM ({query}) AS query LIMIT 0")
+        return arrow_schema(cursor.description)
+    finally:
+        cursor.close()
+
+def copy_query(connection, query, chunk_size):
+    # COPY sends the whole result as one CSV stream, PostgreSQL doesn't build a row message per row
+    # and Arrow CSV reader parses it in C++ straight into typed columns instead of Python tuples
+    query = query.strip().rstrip(";")
+    schema = schema_of_query(connection, query)
+
+    # Timestamp with time zone is written with +00 offset, which Arrow parses
+    cursor = connection.cursor()
+    cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+
+    # copy_expert writes into one end of the pipe on its own thread while chunks are parsed from the other end
+    read_fd, write_fd = os.pipe()
+    copy_error = []
+
+    def copy_to_pipe():
+        try:
+            with os.fdopen(write_fd, "wb") as sink:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", sink)
+        except Exception as e:
+            copy_error.append(e)
+
+    copy_thread = threading.Thread(target = copy_to_pipe, name = "copy-extract", daemon = True)
+    copy_thread.start()
+
+    source = os.fdopen(read_fd, "rb")
+    try:
+        # Empty result or failed COPY doesn't write anything, Arrow can't open CSV without any line
+        reader = []
+        if(len(source.peek(1)) > 0):
+            # Unquoted empty field is NULL, quoted empty field "" is empty string, booleans are t and f
+            reader = pa_csv.open_csv(
+                source,
+                read_options = pa_csv.ReadOptions(column_names = schema.names),
+                parse_options = pa_csv.ParseOptions(newlines_in_values = True),
+                convert_options = pa_csv.ConvertOptions(
+                    column_types = schema,
+                    null_values = [""],
+                    strings_can_be_null = True,
+                    quoted_strings_can_be_null = False,
+                    true_values = ["t"],
+                    false_values = ["f"]
+                )
+            )
+
+        # Batches follow the reader block size, they are regrouped into parts of exactly chunk_size rows
+        batches = []
+        n_rows = 0
+        for batch in reader:
+            batches.append(batch)
+            n_rows += batch.num_rows
+
+            while(n_rows >= chunk_size):
+                table = pa.Table.from_batches(batches, schema = schema)
+                yield table.slice(0, chunk_size).combine_chunks()
+
+                batches = table.slice(chunk_size).to_batches()
+                n_rows -= chunk_size
+
+        if(n_rows > 0):
+            yield pa.Table.from_batches(batches, schema = schema).combine_chunks()
+
+    finally:
+        # Closing the read end first stops copy_expert with broken pipe if reading ended early
+        source.close()
+        copy_thread.join()
+        cursor.close()
+
+    if(len(copy_error) > 0):
+        raise copy_error[0]
+
+def query_tables(connection, query, chunk_size, backend = "cursor"):
+    if(backend == "cursor"):
+        return stream_query(connection = connection, query = query, chunk_size = chunk_size)
+
+    elif(backend == "copy"):
+        return copy_query(connection = connection, query = query, chunk_size = chunk_size)
+
+    else:
+        raise RuntimeError(f"The parameter 'backend' expected 'cursor' or 'copy', but {str(backend)} is given.")
+
+def keyset_query(connection, pk_col, lower_bound, upper_bound, chunk_size):
+    # Pages ordered by (created_at, primary key), every page starts right after the last row of previous page,
+    # so no row is read twice even when many rows share the same created_at
+    cursor = connection.cursor()
+    schema = None
+
+    # Primary key column comes from a Variable, it is quoted as identifier instead of being pasted into the query
+    first_page_query = sql.SQL("""
+                               SELECT *
+                               FROM data_credit
+                               WHERE created_at >= %s
+                               AND created_at <= %s
+                               ORDER BY created_at ASC, {pk} ASC
+                               LIMIT %s;
+                               """).format(pk = sql.Identifier(pk_col))
+    next_page_query = sql.SQL("""
+                               SELECT *
+                               FROM data_credit
+                               WHERE (created_at, {pk}) > (%s, %s)
+                               AND created_at <= %s
+                               ORDER BY created_at ASC, {pk} ASC
+                               LIMIT %s;
+                               """).format(pk = sql.Identifier(pk_col))
+
+    try:
+        while True:
+            # Only the date is known before the first page of the first run, the whole day is included
+            if(lower_bound[1] is None):
+                cursor.execute(first_page_query, (lower_bound[0], upper_bound, chunk_size))
+            else:
+                cursor.execute(next_page_query, (lower_bound[0], lower_bound[1], upper_bound, chunk_size))
+            rows = cursor.fetchall()
+
+            # Every page is its own short transaction, no snapshot is held while the page is pushed
+            connection.commit()
+
+            if(len(rows) == 0):
+                break
+
+            if(schema is None):
+                schema = arrow_schema(cursor.description)
+
+            table = rows_to_table(rows, schema)
+            lower_bound = [table.column("created_at")[-1].as_py(), table.column(pk_col)[-1].as_py()]
+
+            yield table, lower_bound
+
+            if(len(rows) < chunk_size):
+                break
+
+    finally:
+        cursor.close()
+
+def write_parts(tables, prefix, bucket_name, watermark_col = "created_at"):
+    # Every chunk is pushed as its own part as soon as it is fetched, so only one chunk is held in memory
+    part_keys = []
+    n_rows = 0
+    watermark = None
+
+    for table in tables:
+        key = f"{prefix}part-{len(part_keys):05d}.parquet"
+        utils.minio_do(
+            method = "push",
+            key = key,
+            bucket_name = bucket_name,
+            data = table
+        )
+
+        part_keys.append(key)
+        n_rows += table.num_rows
+        watermark = table.column(watermark_col)[-1].as_py()
+
+    # Parts left by previous attempt with different chunk size don't belong to this extraction
+    stale_keys = [key for key in utils.minio_do(method = "list", key = prefix, bucket_name = bucket_name) if key not in part_keys]
+    if(len(stale_keys) > 0):
+        utils.minio_do(method = "delete", key = stale_keys, bucket_name = bucket_name)
+
+    return part_keys, n_rows, watermark
+
+def split_date_range(start_date, end_date, n_partitions):
+    # Contiguous ranges of whole days [start, end), together they cover start_date until end_date inclusive
+    n_days = (end_date - start_date).days + 1
+    n_partitions = max(1, min(n_partitions, n_days))
+
+    bounds = [start_date + timedelta(days = n_days * i // n_partitions) for i in range(n_partitions + 1)]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def extract_partition(db_conn_id, query, prefix, bucket_name, chunk_size, backend = "cursor"):
+    # Every partition checks out its own connection, one psycopg2 connection can't run concurrent queries
+    with utils.database_connection(db_conn_id = db_conn_id) as (connection, _):
+        part_keys, n_rows, watermark = write_parts(
+            tables = query_tables(
+                connection = connection,
+                query = query,
+                chunk_size = chunk_size,
+                backend = backend
+            ),
+            prefix = prefix,
+            bucket_name = bucket_name
+        )
+
+    return {
+        "prefix": prefix,
+        "parts": part_keys,
+        "rows": n_rows,
+        "watermark": watermark
+    }
+
+def read_tables(part_keys, bucket_name):
+    if(len(part_keys) == 0):
+        raise RuntimeError("No part files are given to be read.")
+
+    tables = [utils.minio_do(method = "pull", key = key, bucket_name = bucket_name) for key in part_keys]
+
+    return pa.concat_tables(tables).to_pandas()
+
+def read_parts(prefix, bucket_name):
+    part_keys = [key for key in utils.minio_do(method = "list", key = prefix, bucket_name = bucket_name) if key.endswith(".parquet")]
+    if(len(part_keys) == 0):
+        raise RuntimeError(f"No part files are found under prefix '{prefix}'.")
+
+    return read_tables(part_keys, bucket_name)
+
+def read_manifest(key, bucket_name):
+    # Only parts listed in the manifest are read, leftovers of other attempts under the same prefix are ignored
+    manifest = utils.minio_do(method = "pull", key = key, bucket_name = bucket_name)
+
+    part_keys = [part_key for partition in manifest["partitions"] for part_key in partition["parts"]]
+    if(len(part_keys) == 0):
+        raise RuntimeError(f"Manifest '{key}' doesn't list any part file.")
+
+    return read_tables(part_keys, bucket_name)
@@ -0,0 +1,115 @@
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+from credit_scoring_service.utils import utils
+
+# Raw rows of every extraction are kept in the bucket as one Parquet file per created_at date per run,
+# e.g. feature_store/credit_data/created_at=2023-01-01/part-20230102010000000000.parquet
+FEATURE_STORE_PREFIX = "feature_store/credit_data/"
+DATE_COL = "created_at"
+
+def partition_prefix(date):
+    return f"{FEATURE_STORE_PREFIX}{DATE_COL}={date}/"
+
+def partition_date(key):
+    return key[len(FEATURE_STORE_PREFIX):].split("/")[0].split("=", 1)[1]
+
+def new_part_name():
+    # Part names sort in the order they are written, newer part of the same date comes later
+    return f"part-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}.parquet"
+
+def normalize_types(dataset):
+    # NUMERIC columns fetched in pickle mode hold Decimal, Parquet parts of other modes hold float64
+    dataset = dataset.copy()
+    for col in dataset.columns[dataset.dtypes == object]:
+        values = dataset[col].dropna()
+        if(len(values) > 0 and isinstance(values.iloc[0], Decimal)):
+            dataset[col] = dataset[col].astype("float64")
+
+    return dataset
+
+def list_partitions(bucket_name):
+    # Date of every partition and its part keys in write order
+    partitions = {}
+    for key in utils.minio_do(method = "list", key = FEATURE_STORE_PREFIX, bucket_name = bucket_name):
+        if(not key.endswith(".parquet")):
+            continue
+
+        partitions.setdefault(partition_date(key), []).append(key)
+
+    return dict(sorted(partitions.items()))
+
+def merge_parts(parts, primary_key):
+    # Extraction could read the same row again, e.g. the last extracted day is read again by the next run.
+    # Rows of later parts replace rows with the same primary key, without the key the latest part of the date
+    # is kept whole, modes without primary key always extract whole days.
+    if(primary_key in parts[-1].columns):
+        return pd.concat(parts, ignore_index = True).drop_duplicates(subset = primary_key, keep = "last")
+
+    return parts[-1]
+
+def append(dataset, bucket_name):
+    if(DATE_COL not in dataset.columns):
+        raise RuntimeError(f"Feature store expected column '{DATE_COL}' to partition the rows, but it is not found.")
+
+    dataset = normalize_types(dataset)
+    part_name = new_part_name()
+
+    # Only the dates of this extraction are written, existing parts are never rewritten
+    objects = {
+        f"{partition_prefix(date)}{part_name}": rows.reset_index(drop = True)
+        for date, rows in dataset.groupby(DATE_COL, sort = True)
+    }
+    utils.minio_batch_do(method = "push", bucket_name = bucket_name, objects = objects)
+
+    print(f"{len(dataset)} rows has been appended to feature store as {len(objects)} date partitions.")
+
+    return sorted({partition_date(key) for key in objects})
+
+def read_window(bucket_name, end_date, window_days = None, primary_key = "id"):
+    # Window covers window_days dates until end_date inclusive, all dates until end_date when window_days is None
+    end_date = utils.parse_datetime(end_date)
+    start_date = None if window_days is None else end_date - timedelta(days = window_days - 1)
+
+    partitions = {
+        date: keys for date, keys in list_partitions(bucket_name).items()
+        if(utils.parse_datetime(date) <= end_date and (start_date is None or utils.parse_datetime(date) >= start_date))
+    }
+    if(len(partitions) == 0):
+        raise RuntimeError(f"No feature store partitions are found until {end_date.strftime('%Y-%m-%d')}.")
+
+    parts = utils.minio_batch_do(
+        method = "pull",
+        bucket_name = bucket_name,
+        keys = [key for keys in partitions.values() for key in keys]
+    )
+
+    dataset = pd.concat(
+        [merge_parts([parts[key] for key in keys], primary_key) for keys in partitions.values()],
+        ignore_index = True
+    )
+    print(f"{len(dataset)} rows of {len(partitions)} dates has been read from feature store.")
+
+    return dataset
+
+def compact(bucket_name, primary_key = "id", min_parts = 2, dates = None):
+    # Every date with at least min_parts parts is rewritten as one part, the new part is pushed before
+    # the old parts are deleted so readers never miss rows of the date
+    n_compacted = 0
+    for date, keys in list_partitions(bucket_name).items():
+        if(len(keys) < min_parts or (dates is not None and date not in dates)):
+            continue
+
+        parts = utils.minio_batch_do(method = "pull", bucket_name = bucket_name, keys = keys)
+        utils.minio_do(
+            method = "push",
+            key = f"{partition_prefix(date)}{new_part_name()}",
+            bucket_name = bucket_name,
+            data = merge_parts([parts[key] for key in keys], primary_key).reset_index(drop = True)
+        )
+        utils.minio_do(method = "delete", key = keys, bucket_name = bucket_name)
+        n_compacted += 1
+
+    print(f"{n_compacted} feature store partitions has been compacted.")
+
+    return n_compacted
@@ -1,5 +1,8 @@
+import json
+import hashlib
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.preprocessing import StandardScaler
@@ -24,6 +27,32 @@ def split_train_test(X, y, test_size, random_state=None):
 
     return X_train, X_test, y_train, y_test
 
+def split_train_test_index(y, test_size, holdout_test_size, random_state=None):
+    # Same rows as split_train_test of the whole set then of the rest, but only as positions. Positions are ordered
+    # train, valid, then test, so rows transformed in this order make every set one contiguous slice of the matrix.
+    # test_size is the share of all rows held out from train, holdout_test_size is the share of the held out rows that go to test.
+    positions = np.arange(len(y), dtype = np.int32)
+
+    train, not_train = train_test_split(
+        positions,
+        test_size = test_size,
+        stratify = y,
+        random_state = random_state
+    )
+    valid, test = train_test_split(
+        not_train,
+        test_size = holdout_test_size,
+        stratify = y.iloc[not_train],
+        random_state = random_state
+    )
+
+    return {
+        "index": np.concatenate((train, valid, test)),
+        "train": [0, len(train)],
+        "valid": [len(train), len(train) + len(valid)],
+        "test": [len(train) + len(valid), len(y)]
+    }
+
 def split_num_cat(X, num_col, cat_col):
     X_num = X[num_col]
     X_cat = X[cat_col]
@@ -74,14 +103,16 @@ def split_cat_data(X_cat, ohe_col, le_col):
 
     return X_cat_ohe, X_cat_le
 
-def fit_ohe_encoder(X_cat_ohe):
-    categories = []
-    for col in X_cat_ohe.columns:
-        unique_value_raw = list(set(X_cat_ohe[col]))
+def fit_ohe_encoder(X_cat_ohe, categories = None):
+    # Categories could be collected beforehand, e.g. by chunked fit over the whole train set
+    if(categories is None):
+        categories = []
+        for col in X_cat_ohe.columns:
+            unique_value_raw = list(set(X_cat_ohe[col]))
 
-        unique_value = [val for val in unique_value_raw if val != 'KOSONG']
+            unique_value = [val for val in unique_value_raw if val != 'KOSONG']
 
-        categories.append(unique_value)
+            categories.append(unique_value)
 
     ohe_encoder = OneHotEncoder(categories = categories,
                                 handle_unknown = 'ignore')
@@ -105,27 +136,64 @@ def transform_ohe_encoder(X_cat_ohe, ohe_encoder):
 
     return X_cat_ohe_encoded
 
-def transform_le_encoder(X_cat_le):
-    loan_grade_col = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'KOSONG']
-    loan_grade_mapper = {val:i+1 for i, val in enumerate(loan_grade_col)}
+# Columns of raw data used as features, the order is the order of the transformed matrix
+NUMERICAL_COL = ['person_age', 'person_income', 'person_emp_length',
+                'loan_amnt', 'loan_int_rate', 'loan_percent_income',
+                'cb_person_cred_hist_length']
+
+CATEGORICAL_COL = ['person_home_ownership', 'loan_intent',
+                'loan_grade', 'cb_person_default_on_file']
+
+OHE_COL = ['person_home_ownership', 'loan_intent']
+
+LE_COL = ['loan_grade', 'cb_person_default_on_file']
+
+# Label encoding maps, built once when module is imported
+LOAN_GRADE_COL = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'KOSONG']
+LOAN_GRADE_MAPPER = {val:i+1 for i, val in enumerate(LOAN_GRADE_COL)}
 
-    cb_person_col = ['N', 'KOSONG', 'Y']
-    cb_person_col_mapper = {val:i+1 for i, val in enumerate(cb_person_col)}
+CB_PERSON_COL = ['N', 'KOSONG', 'Y']
+CB_PERSON_COL_MAPPER = {val:i+1 for i, val in enumerate(CB_PERSON_COL)}
 
-    mapper = {'loan_grade': loan_grade_mapper,
-              'cb_person_default_on_file': cb_person_col_mapper}
+LE_MAPPER = {'loan_grade': LOAN_GRADE_MAPPER,
+             'cb_person_default_on_file': CB_PERSON_COL_MAPPER}
 
+def transform_le_encoder(X_cat_le):
     X_cat_le_encoded = X_cat_le.copy()
     for col in X_cat_le_encoded.columns:
-        X_cat_le_encoded[col] = X_cat_le_encoded[col].map(mapper[col])
+        X_cat_le_encoded[col] = X_cat_le_encoded[col].map(LE_MAPPER[col])
 
     return X_cat_le_encoded
 
-def fit_scaler(X_concat):
-    scaler = StandardScaler()
+def fit_scaler(X_concat, with_mean = True):
+    scaler = StandardScaler(with_mean = with_mean)
     scaler.fit(X_concat)
     return scaler
 
+def transform_ohe_encoder_sparse(X_cat_ohe, ohe_encoder):
+    # Same columns as transform_ohe_encoder, kept as CSR matrix instead of densified DataFrame
+    return ohe_encoder.transform(X_cat_ohe).tocsr()
+
+def concat_sparse(X_num, X_cat_ohe_encoded, X_cat_le_encoded):
+    # Numerical and label encoded blocks are dense but narrow, only they are converted when stacked next to OHE block
+    return sp.hstack(
+        (
+            sp.csr_matrix(X_num.to_numpy(dtype = np.float64)),
+            X_cat_ohe_encoded,
+            sp.csr_matrix(X_cat_le_encoded.to_numpy(dtype = np.float64))
+        ),
+        format = "csr"
+    )
+
+def fit_sparse_scaler(X_concat, columns):
+    # Centering would turn every zero of OHE block into non zero value, so sparse matrix is only scaled.
+    # Column names can't be taken from CSR matrix, they are set as if the scaler was fitted on DataFrame.
+    scaler = fit_scaler(X_concat = X_concat, with_mean = False)
+    scaler.feature_names_in_ = np.asarray(columns, dtype = object)
+    scaler.n_features_in_ = len(columns)
+
+    return scaler
+
 def transform_scaler(X_concat, scaler):
     X_concat = X_concat.copy()
 
@@ -137,18 +205,8 @@ def transform_scaler(X_concat, scaler):
 
     return X_concat_scaled
 
-def fit_preprocess_data(X_train):
-    NUMERICAL_COL = ['person_age', 'person_income', 'person_emp_length',
-                    'loan_amnt', 'loan_int_rate', 'loan_percent_income',
-                    'cb_person_cred_hist_length']
-
-    CATEGORICAL_COL = ['person_home_ownership', 'loan_intent',
-                    'loan_grade', 'cb_person_default_on_file']
-
-    OHE_COL = ['person_home_ownership', 'loan_intent']
-
-    LE_COL = ['loan_grade', 'cb_person_default_on_file']
-
+def fit_preprocess_data(X_train, sparse = False):
+    # In sparse mode OHE output stays CSR and the scaler is fitted without centering
     X_train_num, X_train_cat = split_num_cat(
         X = X_train,
         num_col = NUMERICAL_COL,
@@ -177,13 +235,32 @@ def fit_preprocess_data(X_train):
 
     ohe_encoder = fit_ohe_encoder(X_cat_ohe = X_train_cat_ohe)
 
+    X_train_cat_le_encoded = transform_le_encoder(X_cat_le = X_train_cat_le)
+
+    if(sparse):
+        X_train_concat = concat_sparse(
+            X_num = X_train_num_imputed,
+            X_cat_ohe_encoded = transform_ohe_encoder_sparse(
+                X_cat_ohe = X_train_cat_ohe,
+                ohe_encoder = ohe_encoder
+            ),
+            X_cat_le_encoded = X_train_cat_le_encoded
+        )
+
+        columns = list(X_train_num_imputed.columns)
+        for cols in ohe_encoder.categories_:
+            columns.extend(cols)
+        columns.extend(X_train_cat_le_encoded.columns)
+
+        scaler = fit_sparse_scaler(X_concat = X_train_concat, columns = columns)
+
+        return num_imputer, cat_imputer, ohe_encoder, scaler
+
     X_train_cat_ohe_encoded = transform_ohe_encoder(
         X_cat_ohe = X_train_cat_ohe,
         ohe_encoder = ohe_encoder
     )
 
-    X_train_cat_le_encoded = transform_le_encoder(X_cat_le = X_train_cat_le)
-
     X_train_cat_encoded = pd.concat((X_train_cat_ohe_encoded, X_train_cat_le_encoded), axis=1)
 
     X_train_concat = pd.concat((X_train_num_imputed, X_train_cat_encoded), axis=1)
@@ -192,47 +269,514 @@ def fit_preprocess_data(X_train):
 
     return num_imputer, cat_imputer, ohe_encoder, scaler
 
-def transform_preprocess_data(X,
-                    num_imputer, cat_imputer,
-                    ohe_encoder,
-                    scaler):
-    num_col = ['person_age', 'person_income', 'person_emp_length',
-                    'loan_amnt', 'loan_int_rate', 'loan_percent_income',
-                    'cb_person_cred_hist_length']
+def iter_chunks(X, chunk_size):
+    for start in range(0, len(X), chunk_size):
+        yield X.iloc[start:start + chunk_size]
+
+def exact_median(value_counts):
+    # Median from counts of every distinct value, two middle values are averaged for even count like np.median
+    if(len(value_counts) == 0):
+        return np.nan
 
-    cat_col = ['person_home_ownership', 'loan_intent',
-                    'loan_grade', 'cb_person_default_on_file']
+    value_counts = value_counts.sort_index()
+    values = value_counts.index.to_numpy(dtype = np.float64)
+    cumulative = value_counts.to_numpy().cumsum()
+    n = cumulative[-1]
 
-    ohe_col = ['person_home_ownership', 'loan_intent']
+    lower = values[np.searchsorted(cumulative, (n - 1) // 2, side = "right")]
+    upper = values[np.searchsorted(cumulative, n // 2, side = "right")]
 
-    le_col = ['loan_grade', 'cb_person_default_on_file']
+    return (lower + upper) / 2
 
+def fit_preprocess_data_chunked(chunks, sparse = False):
+    # Equivalent of fit_preprocess_data which only holds one chunk of X_train and its transformed copies at a time.
+    # chunks is a function returning new iterator of X_train chunks, the chunks are read twice: the first pass
+    # counts numerical values and collects categories, the second pass fits the scaler on transformed chunks.
+    # Counts of distinct values are mergeable, so the medians are exact, not approximated.
+    num_imputer = None
+    cat_imputer = None
+    value_counts = {col: pd.Series(dtype = np.int64) for col in NUMERICAL_COL}
+    categories = {col: set() for col in OHE_COL}
+
+    for X_chunk in chunks():
+        X_chunk_num, X_chunk_cat = split_num_cat(
+            X = X_chunk,
+            num_col = NUMERICAL_COL,
+            cat_col = CATEGORICAL_COL
+        )
+
+        # Imputers get their fitted attributes from the first chunk, medians are replaced after the first pass
+        if(num_imputer is None):
+            num_imputer = fit_num_imputer(X_num = X_chunk_num)
+            cat_imputer = fit_cat_imputer(X_cat = X_chunk_cat)
+
+        for col in NUMERICAL_COL:
+            value_counts[col] = value_counts[col].add(X_chunk_num[col].value_counts(), fill_value = 0)
+
+        X_chunk_cat_imputed = transform_cat_imputer(
+            X_cat = X_chunk_cat,
+            cat_imputer = cat_imputer
+        )
+
+        for col in OHE_COL:
+            categories[col].update(X_chunk_cat_imputed[col])
+
+    if(num_imputer is None):
+        raise RuntimeError("Chunked fit expected at least one chunk of train set, but no chunk is given.")
+
+    num_imputer.statistics_ = np.array([exact_median(value_counts[col]) for col in NUMERICAL_COL], dtype = np.float64)
+
+    # Sorted, so the encoded columns don't depend on the order of the chunks
+    ohe_categories = [sorted(val for val in categories[col] if val != 'KOSONG') for col in OHE_COL]
+
+    # Chunks are small enough to be scaled densely, sparse mode only needs the scaler without centering
+    ohe_encoder = None
+    scaler = StandardScaler(with_mean = not sparse)
+
+    for X_chunk in chunks():
+        X_chunk_num, X_chunk_cat = split_num_cat(
+            X = X_chunk,
+            num_col = NUMERICAL_COL,
+            cat_col = CATEGORICAL_COL
+        )
+
+        X_chunk_num_imputed = transform_num_imputer(
+            X_num = X_chunk_num,
+            num_imputer = num_imputer
+        )
+
+        X_chunk_cat_imputed = transform_cat_imputer(
+            X_cat = X_chunk_cat,
+            cat_imputer = cat_imputer
+        )
+
+        X_chunk_cat_ohe, X_chunk_cat_le = split_cat_data(
+            X_cat = X_chunk_cat_imputed,
+            ohe_col = OHE_COL,
+            le_col = LE_COL
+        )
+
+        if(ohe_encoder is None):
+            ohe_encoder = fit_ohe_encoder(X_cat_ohe = X_chunk_cat_ohe, categories = ohe_categories)
+
+        X_chunk_cat_ohe_encoded = transform_ohe_encoder(
+            X_cat_ohe = X_chunk_cat_ohe,
+            ohe_encoder = ohe_encoder
+        )
+
+        X_chunk_cat_le_encoded = transform_le_encoder(X_cat_le = X_chunk_cat_le)
+
+        X_chunk_cat_encoded = pd.concat((X_chunk_cat_ohe_encoded, X_chunk_cat_le_encoded), axis=1)
+
+        X_chunk_concat = pd.concat((X_chunk_num_imputed, X_chunk_cat_encoded), axis=1)
+
+        # Running mean and variance are merged chunk by chunk
+        scaler.partial_fit(X_chunk_concat)
+
+    return num_imputer, cat_imputer, ohe_encoder, scaler
+
+def transform_preprocess_data(X,
+                    num_imputer, cat_imputer,
+                    ohe_encoder,
+                    scaler,
+                    timer = None):
+    # Optional timer is called after each stage with the stage name, used for latency instrumentation
     X = X.copy()
 
     X_num, X_cat = split_num_cat(X = X,
-                                 num_col = num_col,
-                                 cat_col = cat_col)
+                                 num_col = NUMERICAL_COL,
+                                 cat_col = CATEGORICAL_COL)
+
+    if(timer is not None):
+        timer("split")
 
     X_num_imputed = transform_num_imputer(X_num = X_num,
                                           num_imputer = num_imputer)
 
+    if(timer is not None):
+        timer("num_imputer")
+
     X_cat_imputed = transform_cat_imputer(X_cat = X_cat,
                                           cat_imputer = cat_imputer)
 
+    if(timer is not None):
+        timer("cat_imputer")
+
     X_cat_ohe, X_cat_le = split_cat_data(X_cat = X_cat_imputed,
-                                         ohe_col = ohe_col,
-                                         le_col = le_col)
+                                         ohe_col = OHE_COL,
+                                         le_col = LE_COL)
 
     X_cat_ohe_encoded = transform_ohe_encoder(X_cat_ohe = X_cat_ohe,
                                               ohe_encoder = ohe_encoder)
 
+    if(timer is not None):
+        timer("ohe_encoder")
+
     X_cat_le_encoded = transform_le_encoder(X_cat_le = X_cat_le)
 
+    if(timer is not None):
+        timer("le_encoder")
+
     X_cat_encoded = pd.concat((X_cat_ohe_encoded, X_cat_le_encoded), axis=1)
 
     X_concat = pd.concat((X_num_imputed, X_cat_encoded), axis=1)
 
+    if(timer is not None):
+        timer("concat")
+
     X_clean = transform_scaler(X_concat = X_concat,
                                scaler = scaler)
 
-    return X_clean
\ No newline at end of file
+    if(timer is not None):
+        timer("scaler")
+
+    return X_clean
+
+def extract_preprocess_params(num_imputer, cat_imputer, ohe_encoder, scaler):
+    # Pull every fitted value needed by transform_preprocess_data out of the artifacts
+    num_col = list(num_imputer.feature_names_in_)
+    ohe_col = list(ohe_encoder.feature_names_in_)
+    columns = list(scaler.feature_names_in_)
+    le_col = columns[len(num_col) + sum(len(cats) for cats in ohe_encoder.categories_):]
+
+    cat_fill_value = dict(zip(cat_imputer.feature_names_in_, cat_imputer.statistics_))
+
+    if(scaler.with_mean):
+        mean = np.asarray(scaler.mean_, dtype = np.float64)
+    else:
+        mean = np.zeros(len(columns), dtype = np.float64)
+
+    if(scaler.with_std):
+        scale = np.asarray(scaler.scale_, dtype = np.float64)
+    else:
+        scale = np.ones(len(columns), dtype = np.float64)
+
+    return {
+        "num_col": num_col,
+        "num_median": np.asarray(num_imputer.statistics_, dtype = np.float64),
+        "ohe_col": ohe_col,
+        "ohe_categories": [np.asarray(cats) for cats in ohe_encoder.categories_],
+        "ohe_fill_value": [cat_fill_value[col] for col in ohe_col],
+        "le_col": le_col,
+        "le_fill_value": [cat_fill_value[col] for col in le_col],
+        "columns": columns,
+        "mean": mean,
+        "scale": scale
+    }
+
+class CompiledPreprocessor:
+    # Equivalent of transform_preprocess_data for single record (dict) without pandas and sklearn.
+    # Every possible output of OHE and label encoding is scaled in advance, so transforming
+    # a record only costs a few dictionary lookups and arithmetic per numerical column.
+    # The lookups are plain Python copies of the params held by every worker even when params are memory mapped,
+    # they grow with the number of columns and categories only (about 1 KB for data_credit), not with data.
+    def __init__(self, params):
+        self.params = params
+        self.columns = list(params["columns"])
+
+        mean = [float(val) for val in params["mean"]]
+        scale = [float(val) for val in params["scale"]]
+
+        n_num = len(params["num_col"])
+        self.num_items = []
+        for i, col in enumerate(params["num_col"]):
+            self.num_items.append((col, float(params["num_median"][i]), mean[i], scale[i]))
+
+        # Scaled row of OHE block when no category is active, the position and scaled value of each known category
+        pos = n_num
+        self.ohe_zero_row = []
+        self.ohe_items = []
+        for col, cats, fill_value in zip(params["ohe_col"], params["ohe_categories"], params["ohe_fill_value"]):
+            hot_value = {}
+            for cat in cats:
+                self.ohe_zero_row.append((0.0 - mean[pos]) / scale[pos])
+                hot_value[cat] = (pos - n_num, (1.0 - mean[pos]) / scale[pos])
+                pos += 1
+
+            self.ohe_items.append((col, fill_value, hot_value))
+
+        # Label encoded value already scaled, unknown label become NaN as in transform_le_encoder
+        self.le_items = []
+        for col, fill_value in zip(params["le_col"], params["le_fill_value"]):
+            scaled_value = {val: (code - mean[pos]) / scale[pos] for val, code in LE_MAPPER[col].items()}
+            self.le_items.append((col, fill_value, scaled_value))
+            pos += 1
+
+        if(pos != len(self.columns)):
+            raise RuntimeError(f"Fitted artifacts produce {pos} columns, but scaler expects {len(self.columns)} columns.")
+
+    def transform_row(self, record):
+        row = []
+
+        for col, median, mean, scale in self.num_items:
+            val = record.get(col)
+            if(val is None or val != val):
+                val = median
+
+            row.append((float(val) - mean) / scale)
+
+        ohe_row = list(self.ohe_zero_row)
+        for col, fill_value, hot_value in self.ohe_items:
+            val = record.get(col)
+            if(val != val):
+                val = fill_value
+
+            if(val in hot_value):
+                i, scaled_value = hot_value[val]
+                ohe_row[i] = scaled_value
+
+        row.extend(ohe_row)
+
+        for col, fill_value, scaled_value in self.le_items:
+            val = record.get(col)
+            if(val != val):
+                val = fill_value
+
+            row.append(scaled_value.get(val, np.nan))
+
+        return row
+
+    def transform_record(self, record):
+        return np.array([self.transform_row(record)], dtype = np.float64)
+
+    def transform_records(self, records):
+        return np.array([self.transform_row(record) for record in records], dtype = np.float64).reshape(len(records), len(self.columns))
+
+class FusedTransformer:
+    # Equivalent of transform_preprocess_data for large DataFrame, imputed, encoded, and scaled values are written
+    # chunk by chunk straight into one preallocated matrix, so only temporaries of one chunk exist next to the output
+    def __init__(self, params, dtype = np.float32, chunk_size = 65536):
+        self.params = params
+        self.columns = list(params["columns"])
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+
+        mean = np.asarray(params["mean"], dtype = np.float64)
+        scale = np.asarray(params["scale"], dtype = np.float64)
+
+        n_num = len(params["num_col"])
+        self.num_col = list(params["num_col"])
+        self.num_median = np.asarray(params["num_median"], dtype = np.float64)
+        self.num_mean = mean[:n_num]
+        self.num_scale = scale[:n_num]
+
+        # Scaled value of every OHE column when its category is active and when it isn't
+        pos = n_num
+        self.ohe_items = []
+        for col, cats, fill_value in zip(params["ohe_col"], params["ohe_categories"], params["ohe_fill_value"]):
+            end = pos + len(cats)
+            cold_value = (0.0 - mean[pos:end]) / scale[pos:end]
+            hot_value = (1.0 - mean[pos:end]) / scale[pos:end]
+            self.ohe_items.append((col, pd.Index(cats), fill_value, pos, end, cold_value, hot_value))
+            pos = end
+
+        # Label encoding map already scaled, unknown label become NaN as in transform_le_encoder
+        self.le_items = []
+        for col, fill_value in zip(params["le_col"], params["le_fill_value"]):
+            scaled_value = {val: (code - mean[pos]) / scale[pos] for val, code in LE_MAPPER[col].items()}
+            self.le_items.append((col, fill_value, pos, scaled_value))
+            pos += 1
+
+        if(pos != len(self.columns)):
+            raise RuntimeError(f"Fitted artifacts produce {pos} columns, but scaler expects {len(self.columns)} columns.")
+
+    def fill_categorical(self, values, fill_value):
+        # Only NaN is imputed like SimpleImputer(missing_values = np.nan), None stays unknown category
+        values = values.to_numpy(dtype = object)
+        values[values != values] = fill_value
+
+        return values
+
+    def transform_chunk(self, X, out):
+        num = X[self.num_col].to_numpy(dtype = np.float64)
+        num = np.where(np.isnan(num), self.num_median, num)
+        out[:, :len(self.num_col)] = (num - self.num_mean) / self.num_scale
+
+        for col, cats, fill_value, start, end, cold_value, hot_value in self.ohe_items:
+            codes = cats.get_indexer(self.fill_categorical(X[col], fill_value))
+            out[:, start:end] = cold_value
+
+            rows = np.flatnonzero(codes >= 0)
+            out[rows, start + codes[rows]] = hot_value[codes[rows]]
+
+        for col, fill_value, pos, scaled_value in self.le_items:
+            out[:, pos] = pd.Series(self.fill_categorical(X[col], fill_value)).map(scaled_value).to_numpy(dtype = np.float64)
+
+    def take_chunk(self, X, rows, start):
+        # Optional rows are positions of X in the order they are written, only one chunk of them is copied at a time
+        if(rows is None):
+            return X.iloc[start:start + self.chunk_size]
+
+        return X.iloc[rows[start:start + self.chunk_size]]
+
+    def transform(self, X, rows = None):
+        n_rows = len(X) if rows is None else len(rows)
+        matrix = np.empty((n_rows, len(self.columns)), dtype = self.dtype)
+
+        for start in range(0, n_rows, self.chunk_size):
+            end = min(start + self.chunk_size, n_rows)
+            self.transform_chunk(self.take_chunk(X, rows, start), matrix[start:end])
+
+        return matrix
+
+    def transform_sparse_chunk(self, X):
+        num = X[self.num_col].to_numpy(dtype = np.float64)
+        num = np.where(np.isnan(num), self.num_median, num)
+        blocks = [sp.csr_matrix(((num - self.num_mean) / self.num_scale).astype(self.dtype))]
+
+        # Only the active category of each row is stored, unknown category leaves the row empty
+        for col, cats, fill_value, start, end, cold_value, hot_value in self.ohe_items:
+            codes = cats.get_indexer(self.fill_categorical(X[col], fill_value))
+            rows = np.flatnonzero(codes >= 0)
+            blocks.append(sp.csr_matrix(
+                (hot_value[codes[rows]].astype(self.dtype), (rows, codes[rows])),
+                shape = (len(X), end - start)
+            ))
+
+        le = np.empty((len(X), len(self.le_items)), dtype = np.float64)
+        for i, (col, fill_value, pos, scaled_value) in enumerate(self.le_items):
+            le[:, i] = pd.Series(self.fill_categorical(X[col], fill_value)).map(scaled_value).to_numpy(dtype = np.float64)
+        blocks.append(sp.csr_matrix(le.astype(self.dtype)))
+
+        return sp.hstack(blocks, format = "csr", dtype = self.dtype)
+
+    def transform_sparse(self, X, rows = None):
+        # Same values as transform, but OHE block is never densified, so it requires the scaler fitted
+        # without centering where every inactive OHE column stays zero
+        for col, cats, fill_value, start, end, cold_value, hot_value in self.ohe_items:
+            if(np.any(cold_value != 0)):
+                raise RuntimeError(f"Sparse transform expected OHE column '{col}' to stay zero when inactive, but the scaler centers it, fit the scaler with sparse = True.")
+
+        n_rows = len(X) if rows is None else len(rows)
+        if(n_rows == 0):
+            return sp.csr_matrix((0, len(self.columns)), dtype = self.dtype)
+
+        return sp.vstack(
+            [self.transform_sparse_chunk(self.take_chunk(X, rows, start)) for start in range(0, n_rows, self.chunk_size)],
+            format = "csr"
+        )
+
+    def transform_frame(self, X, rows = None):
+        # Same column names and index as transform_preprocess_data, the DataFrame wraps the matrix without copy
+        index = X.index if rows is None else X.index[rows]
+        return pd.DataFrame(self.transform(X, rows = rows), columns = self.columns, index = index, copy = False)
+
+def fuse_preprocess_data(num_imputer, cat_imputer, ohe_encoder, scaler, dtype = np.float32):
+    params = extract_preprocess_params(
+        num_imputer = num_imputer,
+        cat_imputer = cat_imputer,
+        ohe_encoder = ohe_encoder,
+        scaler = scaler
+    )
+
+    return FusedTransformer(params, dtype = dtype)
+
+def compile_preprocess_data(num_imputer, cat_imputer, ohe_encoder, scaler):
+    params = extract_preprocess_params(
+        num_imputer = num_imputer,
+        cat_imputer = cat_imputer,
+        ohe_encoder = ohe_encoder,
+        scaler = scaler
+    )
+
+    return CompiledPreprocessor(params)
+
+# Version of the bundle layout, bundle of other version isn't read
+FEATURE_PIPELINE_FORMAT = 1
+FEATURE_PIPELINE_ARTIFACTS = ["num_imputer", "cat_imputer", "ohe_encoder", "scaler"]
+
+class FeaturePipeline:
+    # Column lists, label encoding maps, and fitted imputers, encoder, and scaler as one artifact.
+    # It is stored as plain dict of lists and sklearn objects, so the DAG and the API unpickle it without
+    # importing this module under the same name. The hash covers the schema and every fitted value.
+    def __init__(self, num_imputer, cat_imputer, ohe_encoder, scaler,
+                 num_col = NUMERICAL_COL, cat_col = CATEGORICAL_COL, ohe_col = OHE_COL, le_col = LE_COL,
+                 le_mapper = LE_MAPPER):
+        self.num_imputer = num_imputer
+        self.cat_imputer = cat_imputer
+        self.ohe_encoder = ohe_encoder
+        self.scaler = scaler
+
+        self.num_col = list(num_col)
+        self.cat_col = list(cat_col)
+        self.ohe_col = list(ohe_col)
+        self.le_col = list(le_col)
+        self.le_mapper = {col: dict(mapper) for col, mapper in le_mapper.items()}
+
+        self.params = extract_preprocess_params(
+            num_imputer = num_imputer,
+            cat_imputer = cat_imputer,
+            ohe_encoder = ohe_encoder,
+            scaler = scaler
+        )
+        self.hash = self.compute_hash()
+
+    def compute_hash(self):
+        schema = {
+            "num_col": self.num_col,
+            "cat_col": self.cat_col,
+            "ohe_col": self.ohe_col,
+            "le_col": self.le_col,
+            "le_mapper": self.le_mapper,
+            "columns": [str(col) for col in self.params["columns"]],
+            "ohe_categories": [[str(cat) for cat in cats] for cats in self.params["ohe_categories"]],
+            "num_median": [float(val) for val in self.params["num_median"]],
+            "ohe_fill_value": [str(val) for val in self.params["ohe_fill_value"]],
+            "le_fill_value": [str(val) for val in self.params["le_fill_value"]],
+            "mean": [float(val) for val in self.params["mean"]],
+            "scale": [float(val) for val in self.params["scale"]]
+        }
+
+        return hashlib.sha256(json.dumps(schema, sort_keys = True).encode()).hexdigest()
+
+    def to_bundle(self):
+        bundle = {
+            "format": FEATURE_PIPELINE_FORMAT,
+            "hash": self.hash,
+            "num_col": self.num_col,
+            "cat_col": self.cat_col,
+            "ohe_col": self.ohe_col,
+            "le_col": self.le_col,
+            "le_mapper": self.le_mapper
+        }
+        for name in FEATURE_PIPELINE_ARTIFACTS:
+            bundle[name] = getattr(self, name)
+
+        return bundle
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        bundle_format = bundle.get("format") if isinstance(bundle, dict) else None
+        if(bundle_format != FEATURE_PIPELINE_FORMAT):
+            raise RuntimeError(f"Feature pipeline bundle expected format {FEATURE_PIPELINE_FORMAT}, but {str(bundle_format)} is given.")
+
+        pipeline = cls(
+            **{name: bundle[name] for name in FEATURE_PIPELINE_ARTIFACTS},
+            num_col = bundle["num_col"],
+            cat_col = bundle["cat_col"],
+            ohe_col = bundle["ohe_col"],
+            le_col = bundle["le_col"],
+            le_mapper = bundle["le_mapper"]
+        )
+
+        if(pipeline.hash != bundle["hash"]):
+            raise RuntimeError(f"Feature pipeline bundle expected hash {bundle['hash']}, but its content hashes to {pipeline.hash}.")
+
+        # Transform functions of this module use its own column lists and maps, bundle of other schema would be misread
+        if(pipeline.schema() != cls.schema_of_module()):
+            raise RuntimeError("Feature pipeline bundle was built with other column lists or label encoding maps than this preprocess_util.")
+
+        return pipeline
+
+    def schema(self):
+        return (self.num_col, self.cat_col, self.ohe_col, self.le_col, self.le_mapper)
+
+    @staticmethod
+    def schema_of_module():
+        return (NUMERICAL_COL, CATEGORICAL_COL, OHE_COL, LE_COL, LE_MAPPER)
+
+    def artifacts(self):
+        return tuple(getattr(self, name) for name in FEATURE_PIPELINE_ARTIFACTS)
+
+    def transform(self, X):
+        return transform_preprocess_data(X, *self.artifacts())
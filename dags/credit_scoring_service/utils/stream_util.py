@@ -0,0 +1,170 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 accepts parts of at least 5 MiB except the last one, at most max_concurrency parts are uploaded at the same time
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+MULTIPART_MAX_CONCURRENCY = 4
+READ_BUFFER_SIZE = 1024 * 1024
+
+class MultipartUploadWriter(io.RawIOBase):
+    # File-like object that uploads every part_size bytes written to it as one part of S3 multipart upload,
+    # so the serialized object is never held in memory as a whole
+    def __init__(self, client, bucket_name, key, part_size = MULTIPART_PART_SIZE, max_concurrency = MULTIPART_MAX_CONCURRENCY):
+        if(part_size < 5 * 1024 * 1024):
+            raise RuntimeError(f"The parameter 'part_size' expected at least 5 MiB, but {part_size} is given.")
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+
+        self.buffer = bytearray()
+        self.parts = []
+        self.position = 0
+
+        # Serialization continues while earlier parts are uploading, waiting only when max_concurrency parts are in flight
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers = max_concurrency)
+        self.pending = []
+
+        self.upload_id = client.create_multipart_upload(Bucket = bucket_name, Key = key)["UploadId"]
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        n_bytes = len(data)
+
+        while(len(data) > 0):
+            n_taken = min(self.part_size - len(self.buffer), len(data))
+            self.buffer += data[:n_taken]
+            data = data[n_taken:]
+
+            if(len(self.buffer) >= self.part_size):
+                self.upload_part()
+
+        self.position += n_bytes
+
+        return n_bytes
+
+    def upload_part(self):
+        while(len(self.pending) >= self.max_concurrency):
+            self.parts.append(self.pending.pop(0).result())
+
+        part_number = len(self.parts) + len(self.pending) + 1
+        self.pending.append(self.executor.submit(self.send_part, part_number, bytes(self.buffer)))
+        self.buffer = bytearray()
+
+    def send_part(self, part_number, data):
+        response = self.client.upload_part(
+            Bucket = self.bucket_name,
+            Key = self.key,
+            PartNumber = part_number,
+            UploadId = self.upload_id,
+            Body = data
+        )
+
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def close(self):
+        if(self.closed):
+            return
+
+        # Last part may be smaller than part size, empty object still needs one part
+        if(len(self.buffer) > 0 or len(self.parts) + len(self.pending) == 0):
+            self.upload_part()
+
+        self.parts.extend(future.result() for future in self.pending)
+        self.pending = []
+        self.executor.shutdown()
+
+        self.client.complete_multipart_upload(
+            Bucket = self.bucket_name,
+            Key = self.key,
+            UploadId = self.upload_id,
+            MultipartUpload = {"Parts": self.parts}
+        )
+        super().close()
+
+    def abort(self):
+        # Uploaded parts of failed serialization are discarded, the previous object under the key is kept
+        if(not self.closed):
+            self.executor.shutdown(cancel_futures = True)
+            self.client.abort_multipart_upload(Bucket = self.bucket_name, Key = self.key, UploadId = self.upload_id)
+            super().close()
+
+class StreamingBodyReader(io.RawIOBase):
+    # Raw reader over botocore StreamingBody, wrapped in BufferedReader so deserializers could peek and read small pieces
+    def __init__(self, body):
+        self.body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+
+    def close(self):
+        if(not self.closed):
+            self.body.close()
+            super().close()
+
+def open_body(body):
+    return io.BufferedReader(StreamingBodyReader(body), buffer_size = READ_BUFFER_SIZE)
+
+def compress_writer(sink, compression):
+    # Compression packages are optional, they are only needed when compressed key is used
+    if(compression is None):
+        return sink
+
+    elif(compression == "zstd"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Compression 'zstd' requires package 'zstandard', install it with 'pip install zstandard'.")
+
+        return zstandard.ZstdCompressor().stream_writer(sink, closefd = False)
+
+    elif(compression == "lz4"):
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError("Compression 'lz4' requires package 'lz4', install it with 'pip install lz4'.")
+
+        return lz4.frame.LZ4FrameFile(sink, mode = "wb")
+
+    else:
+        raise RuntimeError(f"The parameter 'compression' expected 'zstd' or 'lz4', but {str(compression)} is given.")
+
+def decompress_reader(source, compression):
+    if(compression is None):
+        return source
+
+    elif(compression == "zstd"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Compression 'zstd' requires package 'zstandard', install it with 'pip install zstandard'.")
+
+        reader = zstandard.ZstdDecompressor().stream_reader(source, closefd = False)
+
+    elif(compression == "lz4"):
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError("Compression 'lz4' requires package 'lz4', install it with 'pip install lz4'.")
+
+        reader = lz4.frame.LZ4FrameFile(source, mode = "rb")
+
+    else:
+        raise RuntimeError(f"The parameter 'compression' expected 'zstd' or 'lz4', but {str(compression)} is given.")
+
+    # joblib peeks the first bytes to detect its own compression
+    return io.BufferedReader(reader, buffer_size = READ_BUFFER_SIZE)
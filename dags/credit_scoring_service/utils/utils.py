@@ -1,38 +1,349 @@
+import os
+import json
+import shutil
 import joblib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from credit_scoring_service.utils import stream_util, artifact_cache, client_registry
 from airflow.models import Variable
-from airflow.providers.amazon.aws.hooks.s3 import S3Hook
-from airflow.providers.postgres.hooks.postgres import PostgresHook
 
-def minio_do(method, key, bucket_name, data = None):
-    s3 = S3Hook(aws_conn_id = 'minio-conn')
+# Format of stored object is detected from the key extension, objects without known extension are pickled with joblib
+OBJECT_FORMATS = {
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".json": "json"
+}
 
-    if(method == "push"):
-        joblib_buffer = BytesIO()
-        joblib.dump(data, joblib_buffer)
-        joblib_buffer.seek(0)
-        
-        s3.load_bytes(
-            bytes_data = joblib_buffer.getvalue(),
+# Whole object compression is detected from the last extension, e.g. preprocess_trainset_20230101.pkl.zst
+COMPRESSION_FORMATS = {
+    ".zst": "zstd",
+    ".lz4": "lz4"
+}
+
+def object_compression(key):
+    for extension, compression in COMPRESSION_FORMATS.items():
+        if(key.endswith(extension)):
+            return compression
+
+    return None
+
+def object_format(key):
+    for extension in COMPRESSION_FORMATS:
+        if(key.endswith(extension)):
+            key = key[:-len(extension)]
+
+    for extension, object_type in OBJECT_FORMATS.items():
+        if(key.endswith(extension)):
+            return object_type
+
+    return "joblib"
+
+def to_arrow_table(data):
+    if(isinstance(data, pa.Table)):
+        return data
+
+    elif(isinstance(data, pa.RecordBatch)):
+        return pa.Table.from_batches([data])
+
+    elif(isinstance(data, pd.Series)):
+        return pa.Table.from_pandas(data.to_frame())
+
+    elif(isinstance(data, pd.DataFrame)):
+        return pa.Table.from_pandas(data)
+
+    else:
+        raise RuntimeError(f"Columnar format expected DataFrame, Series, Arrow table or record batch, but {type(data).__name__} is given.")
+
+def dump_object(data, key, buffer, compression = None):
+    object_type = object_format(key)
+
+    # Parquet is compressed with snappy unless other codec is given, Arrow IPC is uncompressed unless 'lz4' or 'zstd' is given
+    if(object_type == "parquet"):
+        pq.write_table(to_arrow_table(data), buffer, compression = compression or "snappy")
+
+    elif(object_type == "arrow"):
+        table = to_arrow_table(data)
+        with pa.ipc.new_file(buffer, table.schema, options = pa.ipc.IpcWriteOptions(compression = compression)) as writer:
+            writer.write_table(table)
+
+    elif(object_type == "json"):
+        buffer.write(json.dumps(data).encode())
+
+    # Fitted sklearn objects and other Python objects
+    else:
+        joblib.dump(data, buffer)
+
+def load_object(buffer, key, columns = None):
+    object_type = object_format(key)
+
+    if(object_type == "parquet"):
+        table = pq.read_table(buffer, columns = columns, use_pandas_metadata = True)
+
+    elif(object_type == "arrow"):
+        # Arrow IPC file is read without copy from the downloaded buffer, projection only selects the columns
+        table = pa.ipc.open_file(pa.py_buffer(buffer.getbuffer())).read_all()
+        if(columns is not None):
+            index_col = [col for col in (table.schema.pandas_metadata or {}).get("index_columns", []) if isinstance(col, str)]
+            table = table.select(list(columns) + index_col)
+
+    elif(object_type == "json"):
+        return json.load(buffer)
+
+    else:
+        return joblib.load(buffer)
+
+    # Table pushed from pandas comes back as DataFrame, Arrow table stays Arrow table
+    if(table.schema.pandas_metadata is not None):
+        return table.to_pandas()
+
+    return table
+
+def serialize_object(data, key, sink, compression = None):
+    writer = stream_util.compress_writer(sink, object_compression(key))
+    dump_object(
+        data = data,
+        key = key,
+        buffer = writer,
+        compression = compression
+    )
+
+    # Closing compressor writes the end of compressed frame, the sink itself stays open
+    if(writer is not sink):
+        writer.close()
+
+def deserialize_object(source, key, columns = None):
+    source = stream_util.decompress_reader(source, object_compression(key))
+
+    # Parquet and Arrow IPC files need random access, so they are read into memory once
+    if(object_format(key) in ["parquet", "arrow"] and not isinstance(source, BytesIO)):
+        source = BytesIO(source.read())
+
+    return load_object(
+        buffer = source,
+        key = key,
+        columns = columns
+    )
+
+def push_cached(s3, cache, key, bucket_name, data, compression = None):
+    # Object is serialized into the cache directory and uploaded from there, upload_file sends large file
+    # in parts by itself, so the serialized object isn't held in memory either
+    tmp_path = cache.temp_path()
+    try:
+        with open(tmp_path, "wb") as f:
+            serialize_object(data, key, f, compression)
+
+        s3.load_file(
+            filename = tmp_path,
             key = key,
             bucket_name = bucket_name,
             replace = True
         )
 
+        etag = s3.head_object(key = key, bucket_name = bucket_name)["ETag"]
+        cache.add(bucket_name, key, etag, tmp_path)
+    finally:
+        if(os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+
+def pull_cached(s3, cache, key, bucket_name):
+    # Returns open file of the cached object. The file is opened before other task could evict it,
+    # the caller reads the same content even if the cache entry is removed in the meantime.
+    # HEAD is enough to validate the local copy, object is only downloaded when its ETag isn't cached yet
+    head = s3.head_object(key = key, bucket_name = bucket_name)
+    if(head is None):
+        raise RuntimeError(f"Object '{key}' is not found in bucket '{bucket_name}'.")
+
+    cached_file = cache.lookup(bucket_name, key, head["ETag"])
+    if(cached_file is not None):
+        print(f"Artifact cache hit for '{key}', {head['ContentLength']} bytes are read from local disk.")
+        return cached_file
+
+    # IfMatch makes sure the downloaded content is the one whose ETag names the cache entry
+    tmp_path = cache.temp_path()
+    try:
+        body = s3.get_conn().get_object(Bucket = bucket_name, Key = key, IfMatch = head["ETag"])["Body"]
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(body, f, stream_util.READ_BUFFER_SIZE)
+
+        # Opened before it is moved into the cache, the open file follows the file when it is moved or evicted
+        cached_file = open(tmp_path, "rb")
+        cache.add(bucket_name, key, head["ETag"], tmp_path, downloaded = True)
+    except Exception:
+        if(cached_file is not None):
+            cached_file.close()
+        raise
+    finally:
+        if(os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+
+    print(f"Artifact cache miss for '{key}', {head['ContentLength']} bytes are downloaded.")
+
+    return cached_file
+
+def minio_do(method, key, bucket_name, data = None, columns = None, compression = None, stream = False):
+    # One S3Hook and client is reused by every call of this process
+    s3 = client_registry.registry.s3_hook('minio-conn')
+
+    # Local artifact cache of this worker, None when ARTIFACT_CACHE_DIR isn't set
+    cache = artifact_cache.get_cache()
+
+    # Stream mode serializes straight into multipart upload and deserializes straight from the response body,
+    # otherwise the whole serialized object is held in memory
+    if(method == "push"):
+        if(cache is not None):
+            push_cached(s3, cache, key, bucket_name, data, compression)
+            return
+
+        if(stream):
+            joblib_buffer = stream_util.MultipartUploadWriter(
+                client = s3.get_conn(),
+                bucket_name = bucket_name,
+                key = key
+            )
+        else:
+            joblib_buffer = BytesIO()
+
+        try:
+            serialize_object(data, key, joblib_buffer, compression)
+
+            # Completing multipart upload makes the object visible, failed upload keeps the previous object
+            if(stream):
+                joblib_buffer.close()
+        except Exception:
+            if(stream):
+                joblib_buffer.abort()
+            raise
+
+        if(not stream):
+            joblib_buffer.seek(0)
+        
+            s3.load_bytes(
+                bytes_data = joblib_buffer.getvalue(),
+                key = key,
+                bucket_name = bucket_name,
+                replace = True
+            )
+
+    # Columns is projection for Parquet and Arrow IPC objects, other objects are always loaded whole
     elif(method == "pull"):
-        pickle_object = s3.get_key(
-            key = key,
-            bucket_name = bucket_name
-        )
-        pickle_object = BytesIO(pickle_object.get()['Body'].read())
-        pickle_object = joblib.load(pickle_object)
+        if(cache is not None):
+            with pull_cached(s3, cache, key, bucket_name) as f:
+                return deserialize_object(f, key, columns)
 
-        return pickle_object
+        if(stream):
+            pickle_object = stream_util.open_body(s3.get_conn().get_object(Bucket = bucket_name, Key = key)["Body"])
+        else:
+            pickle_object = s3.get_key(
+                key = key,
+                bucket_name = bucket_name
+            )
+            pickle_object = BytesIO(pickle_object.get()['Body'].read())
+
+        return deserialize_object(pickle_object, key, columns)
+
+    # List keys under prefix given as key, sorted so part files keep their order
+    elif(method == "list"):
+        return sorted(s3.list_keys(bucket_name = bucket_name, prefix = key) or [])
+
+    # Delete one key or list of keys
+    elif(method == "delete"):
+        s3.delete_objects(bucket = bucket_name, keys = key)
     
+    else:
+        raise RuntimeError(f"The parameter 'method' expected 'push', 'pull', 'list', or 'delete', but {str(method)} is given.")
+
+# Independent objects are transferred at the same time, at most max_workers of them are held by transfers at once
+BATCH_MAX_WORKERS = 4
+
+def minio_batch_do(method, bucket_name, objects = None, keys = None, ti = None, xcom_key = None, task_ids = None, include_prior_dates = False, stream = False, max_workers = BATCH_MAX_WORKERS):
+    # Push takes mapping of key to object, its keys are pushed to XCom as one list when xcom_key is given.
+    # Pull takes list of keys, or pulls that list from XCom, and returns mapping of key to object in the same order.
+    if(method == "push"):
+        keys = list(objects.keys())
+        transfer = lambda key: minio_do(method = "push", key = key, bucket_name = bucket_name, data = objects[key], stream = stream)
+
+    elif(method == "pull"):
+        if(keys is None):
+            keys = xcom_do(
+                ti = ti,
+                method = "pull",
+                key = xcom_key,
+                task_ids = task_ids,
+                include_prior_dates = include_prior_dates
+            )
+
+            if(keys is None):
+                raise RuntimeError(f"No keys are found in XCom '{xcom_key}' of task '{task_ids}'.")
+
+        transfer = lambda key: minio_do(method = "pull", key = key, bucket_name = bucket_name, stream = stream)
+
     else:
         raise RuntimeError(f"The parameter 'method' expected 'push' or 'pull', but {str(method)} is given.")
 
+    # Every transfer runs to the end, so one failed key doesn't hide failures of the others
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {key: executor.submit(transfer, key) for key in keys}
+
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+
+    if(len(errors) > 0):
+        message = "\n".join(f"- {key}: {type(e).__name__}: {e}" for key, e in errors.items())
+        raise RuntimeError(f"{len(errors)} of {len(keys)} objects failed to be {method}ed:\n{message}") from next(iter(errors.values()))
+
+    # References are only published after every object has been pushed
+    if(method == "push"):
+        if(xcom_key is not None):
+            xcom_do(
+                ti = ti,
+                method = "push",
+                key = xcom_key,
+                data = keys
+            )
+
+        return None
+
+    return results
+
+# Train, valid, and test set are [X, y] in pickle format, columnar format stores them as one table with the target column
+def pack_dataset(X, y, key):
+    if(object_format(key) == "joblib"):
+        return [X, y]
+
+    return pd.concat((X, y), axis = 1)
+
+def unpack_dataset(dataset, target_col = "loan_status"):
+    if(isinstance(dataset, pd.DataFrame)):
+        return [dataset.drop(columns = target_col), dataset[target_col]]
+
+    return dataset
+
+def take_rows(data, start, end):
+    if(isinstance(data, (pd.DataFrame, pd.Series))):
+        return data.iloc[start:end]
+
+    return data[start:end]
+
+def slice_dataset(dataset, split):
+    # Rows of train, valid, and test set are contiguous in the matrix of index split mode,
+    # so DataFrame and array sets are views of the matrix instead of copies
+    X, y = dataset
+    if(X.shape[0] != split["test"][1]):
+        raise RuntimeError(f"Split expected dataset of {split['test'][1]} rows, but {X.shape[0]} rows are given.")
+
+    return [[take_rows(X, *split[name]), take_rows(y, *split[name])] for name in ["train", "valid", "test"]]
+
 def xcom_do(ti, method, data = None, key = None, task_ids = None, include_prior_dates = False):
     if(method == "push"):
         if key == None:
@@ -68,11 +379,24 @@ def variable_do(method, key, data = None, default = None):
         res = Variable.get(key, default_var = None)
         if res != data:
             raise RuntimeError(f"Variabel '{key}' has been tried to set to '{data}', but after verification got data '{res}'.")
+
+    elif(method == "delete"):
+        Variable.delete(key)
+
+    else:
+        raise RuntimeError(f"The parameter 'method' expected 'get', 'set', or 'delete', but {str(method)} is given.")
     
-def connect_database(db_conn_id):
-    postgres_hook = PostgresHook(postgres_conn_id = db_conn_id)
-    
-    connection = postgres_hook.get_conn()
-    cursor = connection.cursor()
+@contextmanager
+def database_connection(db_conn_id):
+    # Connection is checked out of the pool of this connection id and returned to it on exit instead of being closed
+    with client_registry.registry.postgres_connection(db_conn_id) as connection:
+        cursor = connection.cursor()
+        try:
+            yield connection, cursor
+        finally:
+            if(not cursor.closed):
+                cursor.close()
 
-    return connection, cursor
\ No newline at end of file
+def client_stats():
+    # How many S3 clients and database connections were created compared with how many were reused
+    return client_registry.registry.stats()
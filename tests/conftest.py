@@ -0,0 +1,57 @@
+import os
+import sys
+import joblib
+import pytest
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(ROOT_DIR, "api", "models")
+
+# Modules of the API are imported by their name as api.py does from api/src
+sys.path.insert(0, os.path.join(ROOT_DIR, "api", "src"))
+
+# DAG utils are imported from package credit_scoring_service as Airflow does from dags
+sys.path.insert(0, os.path.join(ROOT_DIR, "dags"))
+
+HOME_OWNERSHIP = ["RENT", "OWN", "MORTGAGE", "OTHER"]
+LOAN_INTENT = ["PERSONAL", "EDUCATION", "MEDICAL", "VENTURE", "HOMEIMPROVEMENT", "DEBTCONSOLIDATION"]
+LOAN_GRADE = ["A", "B", "C", "D", "E", "F", "G"]
+DEFAULT_ON_FILE = ["Y", "N"]
+
+def make_credit_frame(n_rows, random_state = 0, unknown = True):
+    # Rows shaped like data_credit with NaN in every column, unknown and lower case categories when unknown is True
+    rng = np.random.default_rng(random_state)
+
+    def categorical(values):
+        pool = values + ([val.lower() for val in values[:2]] + ["UNSEEN"] if unknown else [])
+        column = rng.choice(np.array(pool, dtype = object), size = n_rows)
+        column[rng.random(n_rows) < 0.05] = np.nan
+        return column
+
+    def numerical(values):
+        values = values.astype(np.float64)
+        values[rng.random(n_rows) < 0.05] = np.nan
+        return values
+
+    return pd.DataFrame({
+        "person_age": numerical(rng.integers(20, 70, n_rows)),
+        "person_income": numerical(rng.integers(4000, 300000, n_rows)),
+        "person_home_ownership": categorical(HOME_OWNERSHIP),
+        "person_emp_length": numerical(rng.integers(0, 40, n_rows)),
+        "loan_intent": categorical(LOAN_INTENT),
+        "loan_grade": categorical(LOAN_GRADE),
+        "loan_amnt": numerical(rng.integers(500, 35000, n_rows)),
+        "loan_int_rate": numerical(np.round(rng.uniform(5, 23, n_rows), 2)),
+        "loan_percent_income": numerical(np.round(rng.uniform(0, 0.8, n_rows), 2)),
+        "cb_person_default_on_file": categorical(DEFAULT_ON_FILE),
+        "cb_person_cred_hist_length": numerical(rng.integers(2, 30, n_rows))
+    })
+
+@pytest.fixture(scope = "session")
+def artifacts_20221231():
+    # Fitted num_imputer, cat_imputer, ohe_encoder, and scaler shipped with the API
+    return tuple(
+        joblib.load(os.path.join(MODELS_DIR, f"preprocess_{name}_20221231.pkl"))
+        for name in ["num_imputer", "cat_imputer", "ohe", "scaler"]
+    )
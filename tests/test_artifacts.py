@@ -0,0 +1,86 @@
+import os
+import shutil
+import joblib
+import pytest
+
+from conftest import MODELS_DIR
+
+import preprocess_util
+from artifacts import LocalArtifactBackend, ArtifactReloader, find_preprocess_keys
+
+PREPROCESS_FILES = ["num_imputer", "cat_imputer", "ohe", "scaler"]
+
+@pytest.fixture
+def model_dir(tmp_path):
+    # Shipped model has neither preprocess_version_ nor feature_pipeline_hash_, same as model trained before them
+    for filename in os.listdir(MODELS_DIR):
+        shutil.copy(os.path.join(MODELS_DIR, filename), tmp_path / filename)
+
+    return tmp_path
+
+def copy_preprocess_set(directory, date):
+    for name in PREPROCESS_FILES:
+        shutil.copy(directory / f"preprocess_{name}_20221231.pkl", directory / f"preprocess_{name}_{date}.pkl")
+
+def dump_feature_pipeline(directory, date, artifacts):
+    feature_pipeline = preprocess_util.FeaturePipeline(*artifacts)
+    joblib.dump(feature_pipeline.to_bundle(), directory / f"feature_pipeline_{date}.pkl")
+
+    return feature_pipeline
+
+def test_legacy_model_stays_pinned_to_first_served_set(model_dir):
+    reloader = ArtifactReloader(LocalArtifactBackend(str(model_dir)))
+    assert reloader.reload()
+    assert reloader.current.version.startswith("20221231-")
+
+    # Set written by a later run isn't attached to the model already served
+    copy_preprocess_set(model_dir, "20230105")
+    assert not reloader.reload()
+    assert reloader.current.version.startswith("20221231-")
+    assert reloader.current.preprocess_version == "20221231"
+    assert reloader.n_reloads == 1
+
+def test_legacy_model_keeps_current_set_when_pinned_set_is_gone(model_dir):
+    reloader = ArtifactReloader(LocalArtifactBackend(str(model_dir)))
+    reloader.reload()
+    served = reloader.current
+
+    copy_preprocess_set(model_dir, "20230105")
+    os.remove(model_dir / "preprocess_scaler_20221231.pkl")
+
+    with pytest.raises(RuntimeError, match = "20221231"):
+        reloader.reload()
+    assert reloader.current is served
+
+def test_legacy_model_ignores_feature_pipeline_bundle(model_dir, artifacts_20221231):
+    dump_feature_pipeline(model_dir, "20230105", artifacts_20221231)
+
+    reloader = ArtifactReloader(LocalArtifactBackend(str(model_dir)))
+    reloader.reload()
+    assert reloader.current.preprocess_version == "20221231"
+
+def test_model_with_hash_is_served_only_with_bundle(model_dir, artifacts_20221231):
+    feature_pipeline = dump_feature_pipeline(model_dir, "20221231", artifacts_20221231)
+    copy_preprocess_set(model_dir, "20230105")
+
+    model = joblib.load(model_dir / "best_model.pkl")
+    model.preprocess_version_ = "20221231"
+    model.feature_pipeline_hash_ = feature_pipeline.hash
+    joblib.dump(model, model_dir / "best_model.pkl")
+
+    reloader = ArtifactReloader(LocalArtifactBackend(str(model_dir)))
+    reloader.reload()
+    assert reloader.current.preprocess_version == "20221231"
+
+    keys = LocalArtifactBackend(str(model_dir)).list_keys()
+    assert find_preprocess_keys(keys, bundle = True) == ("20221231", {"feature_pipeline": "feature_pipeline_20221231.pkl"})
+    assert find_preprocess_keys(keys)[0] == "20230105"
+
+def test_mmap_reload_keeps_pinned_set(model_dir, tmp_path_factory):
+    reloader = ArtifactReloader(LocalArtifactBackend(str(model_dir)), mmap_dir = str(tmp_path_factory.mktemp("mmap")))
+    reloader.reload()
+    assert reloader.current.mode == "mmap"
+
+    copy_preprocess_set(model_dir, "20230105")
+    reloader.reload()
+    assert reloader.current.preprocess_version == "20221231"
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from conftest import make_credit_frame
+
+import preprocess_util
+
+# Chunk size not dividing the row count, so the last chunk is shorter and some categories miss in some chunks
+N_ROWS = 5000
+CHUNK_SIZE = 777
+
+@pytest.fixture(scope = "module")
+def X_train():
+    return make_credit_frame(N_ROWS, random_state = 1, unknown = False)
+
+def fit_both(X_train, sparse):
+    in_memory = preprocess_util.fit_preprocess_data(X_train, sparse = sparse)
+    chunked = preprocess_util.fit_preprocess_data_chunked(
+        lambda: preprocess_util.iter_chunks(X_train, CHUNK_SIZE),
+        sparse = sparse
+    )
+
+    return in_memory, chunked
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_chunked_fit_medians_equal(X_train, sparse):
+    (num_imputer, _, _, _), (chunked_num_imputer, _, _, _) = fit_both(X_train, sparse)
+
+    assert list(chunked_num_imputer.feature_names_in_) == list(num_imputer.feature_names_in_)
+    np.testing.assert_array_equal(chunked_num_imputer.statistics_, num_imputer.statistics_)
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_chunked_fit_categories_equal(X_train, sparse):
+    (_, cat_imputer, ohe_encoder, _), (_, chunked_cat_imputer, chunked_ohe_encoder, _) = fit_both(X_train, sparse)
+
+    np.testing.assert_array_equal(chunked_cat_imputer.statistics_, cat_imputer.statistics_)
+
+    # Chunked fit sorts the categories, in-memory fit keeps the order of the encoder, so sets are compared
+    assert len(chunked_ohe_encoder.categories_) == len(ohe_encoder.categories_)
+    for chunked_categories, categories in zip(chunked_ohe_encoder.categories_, ohe_encoder.categories_):
+        assert set(chunked_categories) == set(categories)
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_chunked_fit_transform_allclose(X_train, sparse):
+    in_memory, chunked = fit_both(X_train, sparse)
+
+    X_test = make_credit_frame(1000, random_state = 2, unknown = False)
+    transformed = preprocess_util.transform_preprocess_data(X_test, *in_memory)
+    chunked_transformed = preprocess_util.transform_preprocess_data(X_test, *chunked)
+
+    assert set(chunked_transformed.columns) == set(transformed.columns)
+    chunked_transformed = chunked_transformed[transformed.columns]
+
+    np.testing.assert_allclose(chunked_transformed.to_numpy(), transformed.to_numpy(), rtol = 1e-9, atol = 1e-12)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import preprocess_util
+from conftest import make_credit_frame
+
+def records_of(frame):
+    return frame.to_dict(orient = "records")
+
+def test_transform_records_equals_transform_preprocess_data(artifacts_20221231):
+    frame = make_credit_frame(2000, random_state = 1)
+    compiled = preprocess_util.compile_preprocess_data(*artifacts_20221231)
+
+    expected = preprocess_util.transform_preprocess_data(frame, *artifacts_20221231)
+    result = compiled.transform_records(records_of(frame))
+
+    assert compiled.columns == list(expected.columns)
+    assert np.array_equal(result, expected.to_numpy(dtype = np.float64), equal_nan = True)
+
+def test_transform_record_equals_transform_preprocess_data(artifacts_20221231):
+    frame = make_credit_frame(100, random_state = 2)
+    compiled = preprocess_util.compile_preprocess_data(*artifacts_20221231)
+
+    for record in records_of(frame):
+        expected = preprocess_util.transform_preprocess_data(pd.DataFrame([record]), *artifacts_20221231)
+        assert np.array_equal(compiled.transform_record(record), expected.to_numpy(dtype = np.float64), equal_nan = True)
+
+def test_unknown_and_lower_case_categories_are_not_encoded(artifacts_20221231):
+    compiled = preprocess_util.compile_preprocess_data(*artifacts_20221231)
+    record = records_of(make_credit_frame(1, random_state = 3))[0]
+    record.update(person_home_ownership = "rent", loan_intent = "UNSEEN", loan_grade = "c", cb_person_default_on_file = "y")
+
+    expected = preprocess_util.transform_preprocess_data(pd.DataFrame([record]), *artifacts_20221231)
+    row = compiled.transform_record(record)
+
+    assert np.array_equal(row, expected.to_numpy(dtype = np.float64), equal_nan = True)
+    assert np.isnan(row[0, compiled.columns.index("loan_grade")])
+    assert np.isnan(row[0, compiled.columns.index("cb_person_default_on_file")])
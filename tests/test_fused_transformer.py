@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_credit_frame
+
+import preprocess_util
+
+# Chunk size not dividing the row count, so the rows are written through several chunks and a shorter last chunk
+CHUNK_SIZE = 97
+
+@pytest.fixture(scope = "module")
+def X():
+    # Index not starting at zero, transform_frame has to keep it as transform_preprocess_data does
+    X = make_credit_frame(1000, random_state = 3)
+    X.index = X.index + 1000
+
+    return X
+
+@pytest.fixture(scope = "module")
+def sparse_artifacts():
+    return preprocess_util.fit_preprocess_data(make_credit_frame(2000, random_state = 4, unknown = False), sparse = True)
+
+def fuse(artifacts):
+    fused = preprocess_util.fuse_preprocess_data(*artifacts, dtype = np.float64)
+    fused.chunk_size = CHUNK_SIZE
+
+    return fused
+
+def test_transform_frame_is_identical(X, artifacts_20221231):
+    expected = preprocess_util.transform_preprocess_data(X, *artifacts_20221231)
+    transformed = fuse(artifacts_20221231).transform_frame(X)
+
+    pd.testing.assert_index_equal(transformed.columns, expected.columns)
+    pd.testing.assert_index_equal(transformed.index, expected.index)
+    assert transformed.to_numpy().dtype == np.float64
+    np.testing.assert_array_equal(transformed.to_numpy(), expected.to_numpy())
+
+def test_transform_frame_rows_is_identical(X, artifacts_20221231):
+    rows = np.random.default_rng(5).permutation(len(X))[:500]
+
+    expected = preprocess_util.transform_preprocess_data(X.iloc[rows], *artifacts_20221231)
+    transformed = fuse(artifacts_20221231).transform_frame(X, rows = rows)
+
+    pd.testing.assert_index_equal(transformed.index, expected.index)
+    np.testing.assert_array_equal(transformed.to_numpy(), expected.to_numpy())
+
+def test_transform_sparse_is_identical(X, sparse_artifacts):
+    expected = preprocess_util.transform_preprocess_data(X, *sparse_artifacts)
+    transformed = fuse(sparse_artifacts).transform_sparse(X)
+
+    assert transformed.dtype == np.float64
+    assert transformed.shape == expected.shape
+    np.testing.assert_array_equal(transformed.toarray(), expected.to_numpy())
+
+def test_transform_sparse_requires_uncentered_scaler(X, artifacts_20221231):
+    with pytest.raises(RuntimeError, match = "sparse = True"):
+        fuse(artifacts_20221231).transform_sparse(X)
@@ -0,0 +1,40 @@
+import metrics
+
+def parse(text):
+    samples = {}
+    for line in text.splitlines():
+        if(not line.startswith("#")):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+
+    return samples
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    registry.describe("latency_seconds", "Latency.", [0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        registry.observe("latency_seconds", value, (("stage", "model"),))
+
+    text = registry.render()
+    samples = parse(text)
+
+    assert "# TYPE latency_seconds histogram" in text
+    assert samples['latency_seconds_bucket{stage="model",le="0.1"}'] == 2
+    assert samples['latency_seconds_bucket{stage="model",le="1.0"}'] == 3
+    assert samples['latency_seconds_bucket{stage="model",le="+Inf"}'] == 4
+    assert samples['latency_seconds_count{stage="model"}'] == 4
+    assert samples['latency_seconds_sum{stage="model"}'] == 2.65
+
+def test_histograms_of_workers_add_up():
+    # Every worker exposes the same buckets, so the series of all workers can be summed before histogram_quantile
+    workers = [metrics.Registry(), metrics.Registry()]
+    for registry, values in zip(workers, [[0.0002, 0.003], [0.003, 0.2, 20.0]]):
+        for value in values:
+            registry.observe("credit_scoring_stage_seconds", value)
+
+    rendered = [parse(registry.render()) for registry in workers]
+    assert rendered[0].keys() == rendered[1].keys()
+
+    total = {name: rendered[0][name] + rendered[1][name] for name in rendered[0]}
+    assert total['credit_scoring_stage_seconds_bucket{le="0.005"}'] == 3
+    assert total['credit_scoring_stage_seconds_bucket{le="+Inf"}'] == 5
@@ -0,0 +1,99 @@
+import io
+import pickle
+import numpy as np
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from credit_scoring_service.utils import stream_util
+
+BUCKET_NAME = "credit-scoring-service"
+PART_SIZE = 5 * 1024 * 1024
+
+@pytest.fixture
+def client(monkeypatch):
+    # In-process S3 stand-in, nothing leaves the test
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket = BUCKET_NAME)
+        yield client
+
+def push(client, key, data, compression = None):
+    # Same order as utils.minio_do with stream: the upload is completed only after the whole object is written
+    writer = stream_util.MultipartUploadWriter(client = client, bucket_name = BUCKET_NAME, key = key, part_size = PART_SIZE)
+    try:
+        sink = stream_util.compress_writer(writer, compression)
+        pickle.dump(data, sink, protocol = pickle.HIGHEST_PROTOCOL)
+        if(sink is not writer):
+            sink.close()
+
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    return writer
+
+def pull(client, key, compression = None):
+    source = stream_util.open_body(client.get_object(Bucket = BUCKET_NAME, Key = key)["Body"])
+    return pickle.load(stream_util.decompress_reader(source, compression))
+
+def parts_count(client, key):
+    return client.head_object(Bucket = BUCKET_NAME, Key = key, PartNumber = 1).get("PartsCount", 1)
+
+@pytest.mark.parametrize("compression", [None, "zstd", "lz4"])
+def test_round_trip_of_several_parts(client, compression):
+    if(compression == "zstd"):
+        pytest.importorskip("zstandard")
+    elif(compression == "lz4"):
+        pytest.importorskip("lz4")
+
+    # Random bytes don't compress, so the object spans 3 parts with and without compression
+    data = np.random.default_rng(0).integers(0, 256, 12 * 1024 * 1024, dtype = np.uint8)
+
+    writer = push(client, "data.pkl", data, compression)
+    assert len(writer.parts) == 3
+    assert parts_count(client, "data.pkl") == 3
+
+    np.testing.assert_array_equal(pull(client, "data.pkl", compression), data)
+
+def test_empty_object(client):
+    writer = stream_util.MultipartUploadWriter(client = client, bucket_name = BUCKET_NAME, key = "empty", part_size = PART_SIZE)
+    writer.close()
+
+    assert len(writer.parts) == 1
+    assert client.get_object(Bucket = BUCKET_NAME, Key = "empty")["Body"].read() == b""
+    assert stream_util.open_body(client.get_object(Bucket = BUCKET_NAME, Key = "empty")["Body"]).read() == b""
+
+class FailingObject:
+    # Pickled after several parts have been written, like serializer failing in the middle of a large object
+    def __reduce__(self):
+        raise ValueError("serialization failed")
+
+def test_failed_serialization_keeps_previous_object(client):
+    push(client, "data.pkl", {"version": 1})
+
+    with pytest.raises(ValueError, match = "serialization failed"):
+        push(client, "data.pkl", [bytes(11 * 1024 * 1024), FailingObject()])
+
+    assert pull(client, "data.pkl") == {"version": 1}
+    assert client.list_multipart_uploads(Bucket = BUCKET_NAME).get("Uploads", []) == []
+
+def test_small_part_size_is_rejected(client):
+    with pytest.raises(RuntimeError, match = "part_size"):
+        stream_util.MultipartUploadWriter(client = client, bucket_name = BUCKET_NAME, key = "data.pkl", part_size = 1024)
+
+def test_reader_reads_in_small_pieces(client):
+    client.put_object(Bucket = BUCKET_NAME, Key = "bytes", Body = bytes(range(256)) * 4)
+
+    reader = stream_util.open_body(client.get_object(Bucket = BUCKET_NAME, Key = "bytes")["Body"])
+    pieces = iter(lambda: reader.read(100), b"")
+
+    assert b"".join(pieces) == bytes(range(256)) * 4
+    reader.close()
+    assert reader.closed
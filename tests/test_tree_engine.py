@@ -0,0 +1,57 @@
+import os
+import joblib
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+
+from conftest import MODELS_DIR, make_credit_frame
+
+import preprocess_util
+import tree_engine
+
+@pytest.fixture(scope = "module")
+def model():
+    return joblib.load(os.path.join(MODELS_DIR, "best_model.pkl"))
+
+@pytest.fixture(scope = "module")
+def X(artifacts_20221231):
+    # Unknown and lower case categories become NaN label encoded values, some rows get NaN in every feature too
+    X = preprocess_util.transform_preprocess_data(make_credit_frame(2000, random_state = 6), *artifacts_20221231)
+
+    rng = np.random.default_rng(7)
+    values = X.to_numpy(copy = True)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    X.loc[:, :] = values
+
+    return X
+
+def test_predict_matches_model(model, X):
+    compiled_tree = tree_engine.compile_tree(model)
+
+    assert np.isnan(X.to_numpy()).any()
+    assert len(np.unique(model.predict(X))) > 1
+    np.testing.assert_array_equal(compiled_tree.predict(X.to_numpy()), model.predict(X))
+
+def test_predict_row_matches_model(model, X):
+    compiled_tree = tree_engine.compile_tree(model)
+    expected = model.predict(X)
+
+    predictions = [compiled_tree.predict_row(row) for row in X.to_numpy()]
+    np.testing.assert_array_equal(np.array(predictions), expected)
+
+def test_predict_float32_input_matches_model(model, X):
+    # Features are rounded to float32 before the thresholds are compared, as sklearn does
+    compiled_tree = tree_engine.compile_tree(model)
+    X_float32 = X.astype(np.float32)
+
+    np.testing.assert_array_equal(compiled_tree.predict(X_float32.to_numpy()), model.predict(X_float32))
+
+def test_unsupported_estimator_is_not_compiled():
+    rng = np.random.default_rng(8)
+    X = rng.random((50, 3))
+    y = rng.integers(0, 2, 50)
+
+    assert tree_engine.compile_tree(LogisticRegression().fit(X, y)) is None
+    assert tree_engine.compile_tree(DecisionTreeRegressor().fit(X, y)) is None
+    assert tree_engine.compile_tree(DecisionTreeClassifier().fit(X, np.column_stack((y, y)))) is None
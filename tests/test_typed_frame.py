@@ -0,0 +1,50 @@
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+import pytest
+
+# extraction_util imports the DAG utils, which need Airflow
+pytest.importorskip("airflow")
+
+from credit_scoring_service.utils import extraction_util
+
+COLNAMES = ["id", "person_age", "loan_grade", "loan_percent_income", "created_at"]
+
+# Rows as psycopg2 returns them: NUMERIC as Decimal, NULL as None
+ROWS = [
+    (1, 25, "A", Decimal("0.16"), "2022-11-01"),
+    (2, None, "B", Decimal("0.05"), "2022-11-01"),
+    (3, 41, None, None, "2022-11-02"),
+    (4, 33, "A", Decimal("0.30"), "2022-11-02")
+]
+
+@pytest.fixture
+def frame():
+    return extraction_util.rows_to_frame(rows = ROWS, colnames = COLNAMES)
+
+def test_column_order_is_kept(frame):
+    assert list(frame.columns) == COLNAMES
+    assert len(frame) == len(ROWS)
+
+def test_int_column_without_null_stays_int32(frame):
+    assert frame["id"].dtype == np.int32
+    np.testing.assert_array_equal(frame["id"].to_numpy(), [1, 2, 3, 4])
+
+def test_int_column_with_null_falls_back_to_float32(frame):
+    assert frame["person_age"].dtype == np.float32
+    np.testing.assert_array_equal(frame["person_age"].to_numpy(), np.array([25, np.nan, 41, 33], dtype = np.float32))
+
+def test_decimal_becomes_float32(frame):
+    assert frame["loan_percent_income"].dtype == np.float32
+    np.testing.assert_array_equal(frame["loan_percent_income"].to_numpy(), np.array([0.16, 0.05, np.nan, 0.30], dtype = np.float32))
+
+def test_none_becomes_nan_category(frame):
+    assert isinstance(frame["loan_grade"].dtype, pd.CategoricalDtype)
+    assert set(frame["loan_grade"].cat.categories) == {"A", "B"}
+    assert frame["loan_grade"].isna().tolist() == [False, False, True, False]
+    assert frame["loan_grade"].tolist()[:2] == ["A", "B"]
+
+def test_column_outside_schema_is_unchanged(frame):
+    assert "created_at" not in extraction_util.CREDIT_DATA_SCHEMA
+    assert frame["created_at"].dtype == object
+    assert frame["created_at"].tolist() == [row[4] for row in ROWS]